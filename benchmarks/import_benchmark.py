@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the cold start time of budou.
+
+Each measurement runs in a fresh interpreter, which imports budou and parses
+a Korean sentence without the cache, as a short-lived worker would.
+
+Example invocation:
+
+    $ python -m benchmarks.import_benchmark
+
+Exits with a non-zero status if any of the modules which should be imported
+only on first use has been imported.
+"""
+
+from __future__ import print_function
+import json
+import subprocess
+import sys
+
+REPEAT = 7
+DEFERRED_MODULES = (
+    'googleapiclient.discovery', 'oauth2client.client', 'httplib2',
+    'concurrent.futures', 'asyncio', 'google.appengine.api.memcache')
+SCRIPT = u'''
+import json, sys, time
+start = time.time()
+import budou
+imported = time.time()
+budou.Budou(None).parse(u'\\uc624\\ub298\\uc740 \\ub9d1\\uc74c.', language='ko',
+                        use_cache=False)
+parsed = time.time()
+print(json.dumps({
+    'import': imported - start,
+    'parse': parsed - imported,
+    'modules': [name for name in %r if name in sys.modules],
+}))
+''' % (DEFERRED_MODULES,)
+
+
+def measure():
+  """Runs the script in a fresh interpreter.
+
+  Returns:
+    A dictionary of the elapsed seconds and the deferred modules imported.
+  """
+  output = subprocess.check_output([sys.executable, '-c', SCRIPT])
+  return json.loads(output.decode('utf8'))
+
+
+def main():
+  results = [measure() for _ in range(REPEAT)]
+  import_times = sorted(result['import'] for result in results)
+  parse_times = sorted(result['parse'] for result in results)
+  print('%-20s %10s %10s' % ('', 'median', 'min'))
+  print('%-20s %9.1fms %9.1fms' % (
+      'import budou', import_times[REPEAT // 2] * 1e3, import_times[0] * 1e3))
+  print('%-20s %9.1fms %9.1fms' % (
+      'first Korean parse', parse_times[REPEAT // 2] * 1e3, parse_times[0] * 1e3))
+  modules = results[0]['modules']
+  if modules:
+    print('Imported too early: %s' % ', '.join(modules))
+  return 1 if modules else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The cases of pipeline_benchmark for pytest-benchmark.
+
+This file is not collected with the unit tests. Run it explicitly:
+
+    $ pytest benchmarks/pipeline_bench.py --benchmark-autosave
+    $ pytest benchmarks/pipeline_bench.py --benchmark-compare
+"""
+
+from benchmarks import pipeline_benchmark
+import pytest
+
+SIZES = list(pipeline_benchmark.SIZES)
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('stage', pipeline_benchmark.STAGES)
+def test_stage(benchmark, stage, size):
+  benchmark.group = stage
+  benchmark(pipeline_benchmark.get_stage(
+      stage, pipeline_benchmark.SIZES[size]))
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('operation', ('set', 'get'))
+@pytest.mark.parametrize('name', pipeline_benchmark.CACHES)
+def test_cache(benchmark, tmpdir, monkeypatch, name, operation, size):
+  monkeypatch.chdir(str(tmpdir))
+  cache = pipeline_benchmark.get_cache(name, str(tmpdir))
+  set_value, get_value = pipeline_benchmark.get_cache_operations(
+      cache, pipeline_benchmark.SIZES[size])
+  benchmark.group = 'cache_%s' % operation
+  benchmark(set_value if operation == 'set' else get_value)
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of each stage of Budou.parse and of each cache backend.
+
+Natural Language API is replaced by a fake service which returns canned
+tokens, so the timings are deterministic and cover only the work of budou.
+The same cases are run by pytest-benchmark from pipeline_bench.py.
+
+Example invocation:
+
+    $ python -m benchmarks.pipeline_benchmark
+    $ python -m benchmarks.pipeline_benchmark --save baseline.json
+    $ python -m benchmarks.pipeline_benchmark --compare baseline.json
+
+With --compare, exits with a non-zero status if any case is slower than the
+baseline by more than the tolerance.
+"""
+
+from __future__ import print_function
+from budou.cachefactory import AppEngineCache
+from budou.cachefactory import RedisCache
+from budou.cachefactory import ShelveCache
+from lxml import html
+from six.moves import cPickle as pickle
+import argparse
+import budou
+import collections
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+try:
+  import tracemalloc
+except ImportError:
+  # Allocation is not measured on Python 2.
+  tracemalloc = None
+
+SENTENCES = (
+    u'今日は<b>晴れ</b>です。',
+    u'<a href="/news">東京の天気</a>を確認しましょう。',
+    u'明日の午後から雨が降るでしょう。',
+    u'お出かけの際は<em>傘</em>をお持ちください。',
+)
+# Approximate lengths of the sources in characters.
+SIZES = collections.OrderedDict([
+    ('headline', 20),
+    ('paragraph', 200),
+    ('article', 2000),
+    ('chapter', 20000),
+])
+STAGES = (
+    'preprocess', 'fragment_fromstring', 'source_chunks', 'concatenate',
+    'migrate_html', 'spanize', 'parse')
+CACHES = (
+    'shelve', 'persistent_shelve', 'memory_lru', 'tiered', 'appengine',
+    'redis')
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.3
+
+
+class FakeService(object):
+  """A fake service of Natural Language API which returns canned tokens.
+
+  The tokens of a text are made by JapaneseSegmenter on the first request and
+  returned as they are for the later requests.
+  """
+
+  def __init__(self):
+    self._tokens = {}
+    self._segmenter = budou.JapaneseSegmenter()
+
+  def documents(self):
+    return self
+
+  def annotateText(self, body):
+    text = body['document']['content']
+    if text not in self._tokens:
+      self._tokens[text] = self._get_tokens(text)
+    return FakeRequest({'tokens': self._tokens[text]})
+
+  def _get_tokens(self, text):
+    tokens = []
+    offset = 0
+    for chunk in self._segmenter.segment(text, 'ja'):
+      if chunk.pos != budou.SPACE_POS:
+        tokens.append({
+            'text': {'content': chunk.word, 'beginOffset': offset},
+            'dependencyEdge': {'label': chunk.label},
+            'partOfSpeech': {'tag': chunk.pos},
+        })
+      offset += len(chunk.word)
+    for i, token in enumerate(tokens):
+      forward = i + 1 < len(tokens) and token['dependencyEdge']['label'] in (
+          'NN', 'NUM')
+      token['dependencyEdge']['headTokenIndex'] = i + 1 if forward else i
+    return tokens
+
+
+class FakeRequest(object):
+  """A fake request which returns the response given on construction."""
+
+  def __init__(self, response):
+    self._response = response
+
+  def execute(self, num_retries=0):
+    return self._response
+
+
+class FakeMemcache(object):
+  """A dictionary with the interface of the App Engine memcache module.
+
+  Values are pickled as memcache does, so only the network time is left out.
+  """
+
+  def __init__(self):
+    self._values = {}
+
+  def get(self, key, namespace=None):
+    value = self._values.get(key)
+    return None if value is None else pickle.loads(value)
+
+  def set(self, key, value):
+    self._values[key] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+class FakeRedis(object):
+  """A dictionary with the interface of redis.Redis used by RedisCache.
+
+  Values are bytes as they are in Redis, so only the network time is left out.
+  """
+
+  def __init__(self):
+    self._values = {}
+
+  def get(self, key):
+    return self._values.get(key)
+
+  def mget(self, keys):
+    return [self._values.get(key) for key in keys]
+
+  def set(self, key, value, ex=None):
+    self._values[key] = value
+
+  def pipeline(self, transaction=True):
+    return FakeRedisPipeline(self)
+
+
+class FakeRedisPipeline(object):
+  """A pipeline of FakeRedis which applies the commands on execution."""
+
+  def __init__(self, client):
+    self._client = client
+    self._commands = []
+
+  def set(self, key, value, ex=None):
+    self._commands.append((key, value, ex))
+
+  def execute(self):
+    for key, value, ex in self._commands:
+      self._client.set(key, value, ex=ex)
+    self._commands = []
+
+
+def get_source(size):
+  """Returns an HTML fragment of about the given number of characters.
+
+  Args:
+    size: The number of characters (number).
+
+  Returns:
+    HTML code (unicode).
+  """
+  sentences = []
+  length = 0
+  while length < size:
+    sentence = SENTENCES[len(sentences) % len(SENTENCES)]
+    sentences.append(sentence)
+    length += len(html.fragment_fromstring(
+        sentence, create_parent='body').text_content())
+  return u''.join(sentences)
+
+
+def get_stage(stage, size):
+  """Returns a function which runs the stage on a source of the size.
+
+  The inputs of the stage are computed beforehand by the preceding stages.
+
+  Args:
+    stage: The name of the stage (string).
+    size: The number of characters of the source (number).
+
+  Returns:
+    A function without arguments.
+  """
+  parser = budou.Budou(FakeService())
+  source = get_source(size)
+  preprocessed = parser._preprocess(source)
+  dom = parser._get_dom(preprocessed)
+  text = dom.text_content()
+  source_chunks = parser._get_source_chunks(text, 'ja')
+  chunks = parser._concatenate_chunks(source_chunks)
+  migrated = parser._migrate_html(chunks, dom)
+  attributes = parser._get_attribute_dict(None, budou.DEFAULT_CLASS_NAME)
+  return {
+      'preprocess': lambda: parser._preprocess(source),
+      'fragment_fromstring': lambda: html.fragment_fromstring(
+          preprocessed, create_parent='body'),
+      'source_chunks': lambda: parser._get_source_chunks(text, 'ja'),
+      'concatenate': lambda: parser._concatenate_chunks(source_chunks),
+      'migrate_html': lambda: parser._migrate_html(chunks, dom),
+      'spanize': lambda: parser._spanize(migrated, attributes),
+      'parse': lambda: parser.parse(source, language='ja', use_cache=False),
+  }[stage]
+
+
+def get_cache(name, directory):
+  """Returns a cache of the backend.
+
+  Args:
+    name: The name of the backend (string).
+    directory: A directory to put cache files in (string).
+
+  Returns:
+    A BudouCache object.
+  """
+  path = os.path.join(directory, name)
+  if name == 'shelve':
+    # ShelveCache always uses the file in the current directory.
+    return ShelveCache()
+  if name == 'persistent_shelve':
+    return budou.PersistentShelveCache(path)
+  if name == 'memory_lru':
+    return budou.MemoryLRUCache()
+  if name == 'tiered':
+    return budou.TieredCache(
+        budou.MemoryLRUCache(), budou.PersistentShelveCache(path))
+  if name == 'appengine':
+    return AppEngineCache(FakeMemcache())
+  if name == 'redis':
+    return RedisCache(FakeRedis())
+  raise ValueError('Unknown cache: %s' % name)
+
+
+def get_cache_operations(cache, size):
+  """Returns functions which write and read the chunks of a source.
+
+  Args:
+    cache: A BudouCache object.
+    size: The number of characters of the source (number).
+
+  Returns:
+    A tuple of the functions to set and to get, which include encoding and
+    decoding the chunks as parsers do.
+  """
+  parser = budou.Budou(FakeService())
+  source = get_source(size)
+  text = parser._get_dom(parser._preprocess(source)).text_content()
+  chunks = parser._get_chunks_with_api(text, 'ja')
+  parser._set_cached_chunks(text, 'ja', chunks)
+  return (lambda: cache.set(text, 'ja', parser._encode_chunks(chunks)),
+          lambda: parser._decode_chunks(cache.get(text, 'ja')))
+
+
+def measure(func, repeat):
+  """Measures the best time and the peak allocation of a function.
+
+  Args:
+    func: A function without arguments.
+    repeat: The number of times to run the function (number).
+
+  Returns:
+    A tuple of the best time in seconds and the peak allocation in bytes, or
+    None if allocation can not be measured.
+  """
+  func()
+  seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+  if tracemalloc is None:
+    return seconds, None
+  tracemalloc.start()
+  try:
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return seconds, peak
+
+
+def run(repeat=DEFAULT_REPEAT, sizes=None):
+  """Runs all the cases.
+
+  Args:
+    repeat: The number of times to run each case (number, optional).
+    sizes: The names of the sizes to run (list, optional).
+
+  Yields:
+    Tuples of the case name, the best time and the peak allocation.
+  """
+  sizes = sizes or list(SIZES)
+  for stage in STAGES:
+    for size in sizes:
+      seconds, peak = measure(get_stage(stage, SIZES[size]), repeat)
+      yield '%s/%s' % (stage, size), seconds, peak
+  directory = tempfile.mkdtemp()
+  cwd = os.getcwd()
+  os.chdir(directory)
+  try:
+    for name in CACHES:
+      cache = get_cache(name, directory)
+      for size in sizes:
+        set_value, get_value = get_cache_operations(cache, SIZES[size])
+        for operation, func in (('set', set_value), ('get', get_value)):
+          seconds, peak = measure(func, repeat)
+          yield 'cache_%s/%s/%s' % (operation, name, size), seconds, peak
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(directory)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+  parser.add_argument('--sizes', nargs='+', choices=list(SIZES))
+  parser.add_argument('--save', metavar='PATH',
+                      help='save the timings as a baseline')
+  parser.add_argument('--compare', metavar='PATH',
+                      help='compare the timings with a baseline')
+  parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                      help='allowed slowdown from the baseline (ratio)')
+  options = parser.parse_args(argv)
+  baseline = {}
+  if options.compare:
+    with open(options.compare) as f:
+      baseline = json.load(f)
+  timings = {}
+  regressions = []
+  print('%-40s %12s %12s %10s' % ('case', 'msec', 'peak KiB', 'baseline'))
+  for case, seconds, peak in run(options.repeat, options.sizes):
+    timings[case] = seconds
+    ratio = ''
+    if case in baseline:
+      ratio = '%.2fx' % (seconds / baseline[case])
+      if seconds > baseline[case] * (1 + options.tolerance):
+        regressions.append(case)
+    print('%-40s %12.3f %12s %10s' % (
+        case, seconds * 1e3, '-' if peak is None else '%.1f' % (peak / 1024.0),
+        ratio))
+  if options.save:
+    with open(options.save, 'w') as f:
+      json.dump(timings, f, indent=2, sort_keys=True)
+  if regressions:
+    print('Slower than the baseline: %s' % ', '.join(regressions))
+  return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of converting API tokens into chunks on large token lists.
+
+Example invocation:
+
+    $ python -m benchmarks.source_chunks_benchmark
+
+Exits with a non-zero status if the time per token grows with the number of
+tokens, which means the conversion is no longer linear.
+"""
+
+from __future__ import print_function
+import budou
+import sys
+import timeit
+
+SIZES = (1000, 4000, 16000, 64000)
+MAX_GROWTH = 3.0
+
+
+def get_tokens(size):
+  """Returns synthetic tokens of alternating nouns and particles.
+
+  Args:
+    size: The number of tokens (number).
+
+  Returns:
+    A list of tokens in the form the API returns.
+  """
+  tokens = []
+  for i in range(size):
+    is_noun = i % 2 == 0
+    tokens.append({
+        'text': {'content': u'今日' if is_noun else u'は', 'beginOffset': 0},
+        'dependencyEdge': {
+            'headTokenIndex': i + 1 if is_noun else i - 1,
+            'label': 'NN' if is_noun else 'PRT',
+        },
+        'partOfSpeech': {'tag': 'NOUN' if is_noun else 'PRT'},
+    })
+  offset = 0
+  for token in tokens:
+    token['text']['beginOffset'] = offset
+    offset += len(token['text']['content'])
+  return tokens
+
+
+def main():
+  parser = budou.Budou(None)
+  per_token_times = []
+  print('%10s %12s %16s' % ('tokens', 'seconds', 'usec per token'))
+  for size in SIZES:
+    tokens = get_tokens(size)
+    seconds = min(timeit.repeat(
+        lambda: parser._get_chunks_from_tokens(tokens), number=1, repeat=5))
+    per_token_times.append(seconds / size)
+    print('%10d %12.5f %16.3f' % (size, seconds, seconds / size * 1e6))
+  growth = per_token_times[-1] / per_token_times[0]
+  print('Growth of time per token: %.2fx' % growth)
+  return 0 if growth < MAX_GROWTH else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
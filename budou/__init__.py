@@ -15,24 +15,93 @@
 
 """Package indicator for budou."""
 from .budou import Budou
+from .budou import BudouBase
 from .budou import Chunk
+from .budou import ChunkList
 from .budou import Element
 from .budou import SPACE_POS
 from .budou import HTML_POS
 from .budou import TARGET_LABEL
 from .budou import DEFAULT_CLASS_NAME
+from .budou import BATCH_SEPARATOR
+from .budou import MAX_BATCH_BYTES
+from .budou import DEFAULT_MAX_WORKERS
+from .budou import DEFAULT_NUM_RETRIES
+from .budou import DEFAULT_STREAM_BATCH_SIZE
+from .budou import DEFAULT_BLOCK_XPATH
+from .budou import CHUNKS_FORMAT_MAGIC
+from .budou import CHUNKS_FORMAT_VERSION
+from .budou import DEFAULT_CACHE_COMPRESSION
+from .budou import get_cache
+from .budou import get_credentials
+from .budou import get_discovery_document
+from .budou import build_service
+from .budou import ServiceFactory
+from .budou import DISCOVERY_URL
+from .segmenter import Segmenter
+from .segmenter import JapaneseSegmenter
+from .segmenter import SpaceSegmenter
+from .segmenter import detect_language
+from .metrics import MetricsCollector
+from .metrics import CallbackCollector
+from .metrics import StatsdCollector
 from .cachefactory import load_cache
+from .cachefactory import register_cache_backend
+from .cachefactory import PersistentShelveCache
+from .cachefactory import MemoryLRUCache
+from .cachefactory import TieredCache
+from .cachefactory import RedisCache
 from .cachefactory import CACHE_SALT
 from .cachefactory import SHELVE_CACHE_FILE_NAME
+import sys
+
+if sys.version_info >= (3, 7):
+  def __getattr__(name):
+    # Defers importing asyncio until AsyncBudou is used.
+    if name == 'AsyncBudou':
+      from .asyncbudou import AsyncBudou
+      return AsyncBudou
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+else:
+  try:
+    from .asyncbudou import AsyncBudou
+  except (ImportError, SyntaxError):
+    # AsyncBudou requires Python 3.5+.
+    pass
 
 authenticate = Budou.authenticate
+BudouBase = BudouBase
 Chunk = Chunk
+ChunkList = ChunkList
 Element = Element
 SPACE_POS = SPACE_POS
 HTML_POS = HTML_POS
 TARGET_LABEL = TARGET_LABEL
 DEFAULT_CLASS_NAME = DEFAULT_CLASS_NAME
+BATCH_SEPARATOR = BATCH_SEPARATOR
+MAX_BATCH_BYTES = MAX_BATCH_BYTES
+DEFAULT_MAX_WORKERS = DEFAULT_MAX_WORKERS
+DEFAULT_NUM_RETRIES = DEFAULT_NUM_RETRIES
+DEFAULT_STREAM_BATCH_SIZE = DEFAULT_STREAM_BATCH_SIZE
+DEFAULT_BLOCK_XPATH = DEFAULT_BLOCK_XPATH
+DISCOVERY_URL = DISCOVERY_URL
+CHUNKS_FORMAT_MAGIC = CHUNKS_FORMAT_MAGIC
+CHUNKS_FORMAT_VERSION = CHUNKS_FORMAT_VERSION
+DEFAULT_CACHE_COMPRESSION = DEFAULT_CACHE_COMPRESSION
+ServiceFactory = ServiceFactory
+get_credentials = get_credentials
+get_discovery_document = get_discovery_document
+build_service = build_service
+Segmenter = Segmenter
+JapaneseSegmenter = JapaneseSegmenter
+SpaceSegmenter = SpaceSegmenter
+detect_language = detect_language
+MetricsCollector = MetricsCollector
+CallbackCollector = CallbackCollector
+StatsdCollector = StatsdCollector
 
 load_cache = load_cache
+register_cache_backend = register_cache_backend
+get_cache = get_cache
 CACHE_SALT=CACHE_SALT
 SHELVE_CACHE_FILE_NAME=SHELVE_CACHE_FILE_NAME
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Budou parser for asyncio applications. Requires Python 3.5+ and aiohttp."""
+
+from . import budou
+import asyncio
+import functools
+
+ANNOTATE_TEXT_URL = (
+    'https://language.googleapis.com/v1beta1/documents:annotateText')
+DEFAULT_CONNECTION_LIMIT = 100
+
+
+class AsyncBudou(budou.BudouBase):
+  """An awaitable parser for CJK line break organizer.
+
+  Requests to Natural Language API are sent through a pooled aiohttp session
+  which keeps connections alive, and the cache is accessed in an executor since
+  its backends may block on I/O. The other steps take microseconds on
+  fragments, so they run on the event loop.
+
+  Attributes:
+    credentials: Credentials to authorize API requests, or None to send
+      requests without authorization.
+    api_url: The URL of the annotateText method (string).
+    executor: The executor to access the cache in, or None to use the default
+      executor of the event loop.
+    connection_limit: The maximum number of simultaneous connections of the
+      session (number).
+    segmenter: A Segmenter to use instead of the API (Segmenter, optional).
+    segmenters: A registry of Segmenters keyed by language. See `BudouBase`
+      (dictionary, optional).
+    metrics: A MetricsCollector to report to (MetricsCollector, optional).
+    cache_compression: The compression of chunks stored in the cache. See
+      `BudouBase` (string, optional).
+    cache: The cache of the parser. See `BudouBase` (BudouCache, optional).
+  """
+
+  def __init__(self, credentials=None, session=None, api_url=ANNOTATE_TEXT_URL,
+               executor=None, connection_limit=DEFAULT_CONNECTION_LIMIT,
+               segmenter=None, segmenters=None, metrics=None,
+               cache_compression=budou.DEFAULT_CACHE_COMPRESSION,
+               cache=budou.SHARED_CACHE):
+    super(AsyncBudou, self).__init__(
+        segmenter=segmenter, segmenters=segmenters, metrics=metrics,
+        cache_compression=cache_compression, cache=cache)
+    self.credentials = credentials
+    self.api_url = api_url
+    self.executor = executor
+    self.connection_limit = connection_limit
+    self._session = session
+    self._owns_session = session is None
+
+  @classmethod
+  def authenticate(cls, json_path=None, **kwargs):
+    """Authenticates user for Cloud Natural Language API and returns the parser.
+
+    Args:
+      json_path: A file path to a credential JSON file for a Google Cloud
+      Project which Cloud Natural Language API is enabled (string, optional).
+      **kwargs: Other arguments passed to the constructor.
+
+    Returns:
+      AsyncBudou parser.
+    """
+    return cls(budou.get_credentials(json_path), **kwargs)
+
+  async def parse(self, source, attributes=None, use_cache=True, language='',
+                  classname=budou.DEFAULT_CLASS_NAME):
+    """Parses input HTML code into word chunks and organized code.
+
+    Args:
+      source: HTML code to be processed (unicode).
+      attributes: Attributes of output SPAN tags. See `Budou.parse`
+      (dictionary|string, optional).
+      use_cache: Whether to use cache (boolean, optional).
+      language: A language used to parse text (string, optional).
+      classname: A class name of output SPAN tags (string, optional).
+
+    Returns:
+      A dictionary with the list of word chunks and organized HTML code.
+    """
+    with self._measure('parse'):
+      with self._measure('preprocess'):
+        source = self._preprocess(source)
+      with self._measure('dom'):
+        dom = self._get_dom(source)
+      input_text = dom.text_content()
+      chunks = None
+      if use_cache:
+        chunks = await self._run(self._get_cached_chunks, input_text, language)
+      if chunks is None:
+        segmenter, text_language = self._get_segmenter(input_text, language)
+        if segmenter is not None:
+          chunks = self._get_chunks_with_segmenter(
+              segmenter, input_text, text_language)
+        else:
+          with self._measure('annotate'):
+            tokens = await self._get_annotations_async(input_text, language)
+            chunks = self._get_chunks_from_tokens(tokens)
+          with self._measure('concatenate'):
+            chunks = self._concatenate_chunks(chunks)
+        if use_cache:
+          await self._run(
+              self._set_cached_chunks, input_text, language, chunks)
+      with self._measure('migrate_html'):
+        chunks = self._migrate_html(chunks, dom)
+      with self._measure('render'):
+        return self._get_result(chunks, attributes, classname)
+
+  async def parse_many(self, sources, attributes=None, use_cache=True,
+                       language='', classname=budou.DEFAULT_CLASS_NAME,
+                       max_workers=budou.DEFAULT_MAX_WORKERS):
+    """Parses a list of HTML fragments concurrently.
+
+    Args:
+      sources: A list of HTML code to be processed (list of unicode).
+      attributes: Attributes of output SPAN tags. See `Budou.parse`
+      (dictionary|string, optional).
+      use_cache: Whether to use cache (boolean, optional).
+      language: A language used to parse text (string, optional).
+      classname: A class name of output SPAN tags (string, optional).
+      max_workers: The maximum number of fragments parsed at a time (number,
+      optional).
+
+    Returns:
+      A list of dictionaries in the same order as the sources, each of which
+      has the same form as the one `parse` returns.
+    """
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def parse(source):
+      async with semaphore:
+        return await self.parse(
+            source, attributes, use_cache, language, classname)
+
+    return list(await asyncio.gather(*[parse(source) for source in sources]))
+
+  async def close(self):
+    """Closes the HTTP session if it was created by the parser."""
+    if self._session is not None and self._owns_session:
+      await self._session.close()
+    self._session = None
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    await self.close()
+
+  async def _get_annotations_async(self, text, language='', encoding='UTF32'):
+    """Returns the list of annotations from the given text."""
+    body = self._get_annotation_body(text, language, encoding)
+    headers = {}
+    if self.credentials is not None:
+      access_token = await self._get_access_token()
+      headers['Authorization'] = 'Bearer %s' % access_token
+    session = self._get_session()
+    async with session.post(self.api_url, json=body, headers=headers) as res:
+      res.raise_for_status()
+      response = await res.json()
+    tokens = response.get('tokens', [])
+    self._count_annotation(text, tokens)
+    return tokens
+
+  async def _get_access_token(self):
+    """Returns a valid access token, refreshing it in the executor if needed.
+
+    Returns:
+      An access token (string).
+    """
+    if (self.credentials.access_token is None or
+        self.credentials.access_token_expired):
+      token_info = await self._run(self.credentials.get_access_token)
+      return token_info.access_token
+    return self.credentials.access_token
+
+  def _get_session(self):
+    """Returns the HTTP session, creating it on the first request.
+
+    Returns:
+      An aiohttp.ClientSession object.
+    """
+    if self._session is None:
+      import aiohttp
+      self._session = aiohttp.ClientSession(
+          connector=aiohttp.TCPConnector(limit=self.connection_limit))
+      self._owns_session = True
+    return self._session
+
+  def _run(self, func, *args):
+    """Runs the function in the executor and returns an awaitable result."""
+    # asyncio.get_running_loop is new in Python 3.7.
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    return loop.run_in_executor(self.executor, functools.partial(func, *args))
@@ -16,17 +16,19 @@
 
 """Budou, an automatic CJK line break organizer."""
 
-from googleapiclient import discovery
 from lxml import etree
 from lxml import html
-from oauth2client.client import GoogleCredentials
+from six.moves import collections_abc
 from . import cachefactory
+from .metrics import NULL_TIMER
+from .metrics import Timer
+import array
+import codecs
 import collections
 import hashlib
-import httplib2
-import oauth2client.service_account
 import re
 import six
+import threading
 
 Chunk = collections.namedtuple('Chunk', ['word', 'pos', 'label', 'forward'])
 """Word chunk object.
@@ -52,86 +54,597 @@ SPACE_POS = 'SPACE'
 HTML_POS = 'HTML'
 DEFAULT_CLASS_NAME = 'ww'
 TARGET_LABEL = ('P', 'SNUM', 'PRT', 'AUX', 'SUFF', 'MWV', 'AUXPASS', 'AUXVV')
-cache = cachefactory.load_cache()
+BATCH_SEPARATOR = u'\n'
+MAX_BATCH_BYTES = 100000
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_NUM_RETRIES = 3
+DEFAULT_STREAM_BATCH_SIZE = 16
+DEFAULT_BLOCK_XPATH = '//p|//h1|//h2|//h3|//li'
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr'])
+# Elements which end a window of parse_stream and are passed through.
+BLOCK_ELEMENTS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'body', 'br', 'caption',
+    'dd', 'div', 'dl', 'dt', 'figcaption', 'figure', 'footer', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'header', 'hr', 'html', 'li', 'main', 'nav', 'ol', 'p',
+    'section', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul'])
+# Elements which parse_stream passes through with their content.
+VERBATIM_ELEMENTS = frozenset([
+    'base', 'head', 'link', 'meta', 'pre', 'script', 'style', 'template',
+    'textarea', 'title'])
+DOCTYPE_RE = re.compile(
+    r'\s*(?:<\?.*?\?>\s*|<!--.*?-->\s*)*<!DOCTYPE\b', re.I | re.S)
+WINDOW_BOUNDARY_RE = re.compile(
+    u'(?P<tag><!--.*?-->|<[!?][^>]*>|<(?P<close>/?)(?P<name>[a-zA-Z][^\\s/>]*)'
+    u'[^>]*?(?P<self_close>/?)>)|[\u3002\uff01\uff1f]+|[.!?]+(?=\\s)|\n',
+    re.S)
+CHUNKS_FORMAT_MAGIC = b'BD'
+CHUNKS_FORMAT_VERSION = 1
+COMPRESSIONS = (None, 'zlib', 'lz4')
+DEFAULT_CACHE_COMPRESSION = 'zlib'
+DISCOVERY_URL = (
+    'https://language.googleapis.com/$discovery/rest?version=v1beta1')
+DISCOVERY_ROOT_URL = 'https://language.googleapis.com/'
+DISCOVERY_CACHE_FILE_NAME = 'budou-language-v1beta1-discovery.json'
+# The cache shared by parsers, which is loaded by get_cache on first use.
+cache = None
+# Given as the cache of a parser to use the cache shared by parsers.
+SHARED_CACHE = object()
+_cache_lock = threading.Lock()
+# Discovery documents loaded in this process, keyed by file path.
+_discovery_documents = {}
+_discovery_lock = threading.Lock()
 
 
-class Budou(object):
-  """A parser for CJK line break organizer.
+class ChunkList(collections_abc.Sequence):
+  """A compact immutable list of word chunks.
 
-  Attributes:
-    service: A Resource object with methods for interacting with the service.
+  Words are kept as end offsets into a single string, and parts of speech,
+  labels and directions as small integer codes, instead of a tuple and a string
+  per chunk. Items are returned as Chunk objects, so this can be read like a
+  list of Chunks, but it can not be modified. Parsers use it for cached chunks
+  and return plain lists.
+
+  Args:
+    chunks: An iterable of Chunks (optional).
   """
 
-  def __init__(self, service):
-    self.service = service
+  # Codes of parts of speech and labels shared by all lists.
+  _codes = {}
+  _values = []
+  _codes_lock = threading.Lock()
+  _forward_values = (False, True, None)
+  _forward_codes = {False: 0, True: 1, None: -1}
+
+  def __init__(self, chunks=()):
+    words = []
+    self._ends = array.array('I')
+    self._pos = array.array('H')
+    self._labels = array.array('H')
+    self._forwards = array.array('b')
+    end = 0
+    for chunk in chunks:
+      words.append(chunk.word)
+      end += len(chunk.word)
+      self._ends.append(end)
+      self._pos.append(self._get_code(chunk.pos))
+      self._labels.append(self._get_code(chunk.label))
+      self._forwards.append(self._forward_codes[chunk.forward])
+    self._text = u''.join(words)
 
   @classmethod
-  def authenticate(cls, json_path=None):
-    """Authenticates user for Cloud Natural Language API and returns the parser.
+  def _get_code(cls, value):
+    """Returns the code of a part of speech or a label, assigning a new one."""
+    code = cls._codes.get(value)
+    if code is None:
+      with cls._codes_lock:
+        code = cls._codes.get(value)
+        if code is None:
+          code = len(cls._values)
+          cls._values.append(value)
+          cls._codes[value] = code
+    return code
 
-    If the credential file path is not given, this tries to generate credentials
-    from default settings.
+  def __len__(self):
+    return len(self._ends)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return ChunkList(self[i] for i in range(*index.indices(len(self))))
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError('ChunkList index out of range')
+    begin = self._ends[index - 1] if index else 0
+    return Chunk(
+        self._text[begin:self._ends[index]], self._values[self._pos[index]],
+        self._values[self._labels[index]],
+        self._forward_values[self._forwards[index]])
+
+  def __iter__(self):
+    values = self._values
+    forward_values = self._forward_values
+    begin = 0
+    for end, pos, label, forward in zip(
+        self._ends, self._pos, self._labels, self._forwards):
+      yield Chunk(self._text[begin:end], values[pos], values[label],
+                  forward_values[forward])
+      begin = end
+
+  def __eq__(self, other):
+    if not isinstance(other, (ChunkList, list, tuple)):
+      return NotImplemented
+    return len(self) == len(other) and all(
+        a == b for a, b in zip(self, other))
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    return result if result is NotImplemented else not result
+
+  __hash__ = None
+
+  def __repr__(self):
+    return 'ChunkList(%r)' % (list(self),)
+
+  def __reduce__(self):
+    # Codes are only valid in this process, so chunks are pickled as values.
+    return (ChunkList, (list(self),))
+
+  def to_bytes(self, compression=DEFAULT_CACHE_COMPRESSION):
+    """Encodes the chunks into compact bytes.
+
+    The bytes consist of a header with the magic bytes, the format version
+    and the compression, and a JSON array of the text, the word lengths, the
+    table of parts of speech and labels, and the codes of the chunks in the
+    table. The array is compressed only if that makes it smaller.
 
     Args:
-      json_path: A file path to a credential JSON file for a Google Cloud
-      Project which Cloud Natural Language API is enabled (string, optional).
+      compression: 'zlib', 'lz4' or None (string, optional).
 
     Returns:
-      Budou module.
+      The encoded chunks (bytes).
     """
-    if json_path:
-      credentials = (
-          oauth2client.service_account.ServiceAccountCredentials
-          .from_json_keyfile_name(json_path))
-    else:
-      credentials = GoogleCredentials.get_application_default()
-    scoped_credentials = credentials.create_scoped(
-        ['https://www.googleapis.com/auth/cloud-platform'])
+    import json
+    table = []
+    table_codes = {}
+    for code in self._pos + self._labels:
+      if code not in table_codes:
+        table_codes[code] = len(table)
+        table.append(self._values[code])
+    lengths = []
+    begin = 0
+    for end in self._ends:
+      lengths.append(end - begin)
+      begin = end
+    payload = json.dumps(
+        [self._text, lengths, table,
+         [table_codes[code] for code in self._pos],
+         [table_codes[code] for code in self._labels],
+         list(self._forwards)],
+        ensure_ascii=False, separators=(',', ':')).encode('utf8')
+    compression_code = 0
+    if compression is not None:
+      compressed = _compress(payload, compression)
+      if len(compressed) < len(payload):
+        payload = compressed
+        compression_code = COMPRESSIONS.index(compression)
+    return (CHUNKS_FORMAT_MAGIC +
+            bytes(bytearray([CHUNKS_FORMAT_VERSION, compression_code])) +
+            payload)
+
+  @classmethod
+  def from_bytes(cls, data):
+    """Decodes the chunks encoded by `to_bytes`.
+
+    Args:
+      data: The encoded chunks (bytes).
+
+    Returns:
+      A ChunkList.
+
+    Raises:
+      ValueError: If the data is not encoded chunks, is encoded in an unknown
+        version of the format or with an unavailable compression, or has codes
+        out of range.
+    """
+    import json
+    if not isinstance(data, bytes) or not data.startswith(CHUNKS_FORMAT_MAGIC):
+      raise ValueError('The data is not encoded chunks.')
+    start = len(CHUNKS_FORMAT_MAGIC)
+    header = bytearray(data[start:start + 2])
+    if len(header) < 2 or header[0] != CHUNKS_FORMAT_VERSION:
+      raise ValueError('Unknown version of the chunks format.')
+    payload = _decompress(data[start + 2:], header[1])
+    try:
+      text, lengths, table, pos, labels, forwards = json.loads(
+          payload.decode('utf8'))
+      # Checks the codes before interning the table, since the data may come
+      # from a cache shared over the network.
+      if (not isinstance(text, six.text_type) or
+          not all(0 <= code < len(table) for code in pos + labels) or
+          not all(forward in (-1, 0, 1) and not isinstance(forward, bool)
+                  for forward in forwards)):
+        raise ValueError('The encoded chunks are corrupt: invalid codes.')
+      codes = [cls._get_code(value) for value in table]
+      chunk_list = cls.__new__(cls)
+      chunk_list._text = text
+      chunk_list._ends = array.array('I')
+      end = 0
+      for length in lengths:
+        end += length
+        chunk_list._ends.append(end)
+      chunk_list._pos = array.array('H', [codes[code] for code in pos])
+      chunk_list._labels = array.array('H', [codes[code] for code in labels])
+      chunk_list._forwards = array.array('b', forwards)
+    except (TypeError, IndexError, OverflowError) as error:
+      raise ValueError('The encoded chunks are corrupt: %s' % error)
+    if (end != len(text) or
+        not len(lengths) == len(pos) == len(labels) == len(forwards)):
+      raise ValueError('The encoded chunks are corrupt.')
+    return chunk_list
+
+
+def _compress(data, compression):
+  """Compresses bytes.
+
+  Args:
+    data: The bytes to compress (bytes).
+    compression: 'zlib' or 'lz4' (string).
+
+  Returns:
+    The compressed bytes.
+  """
+  if compression == 'zlib':
+    import zlib
+    return zlib.compress(data)
+  if compression == 'lz4':
+    import lz4.frame
+    return lz4.frame.compress(data)
+  raise ValueError('Unknown compression: %s' % compression)
+
+
+def _decompress(data, compression_code):
+  """Decompresses bytes compressed by `_compress`.
+
+  Args:
+    data: The compressed bytes (bytes).
+    compression_code: The index of the compression in COMPRESSIONS (number).
+
+  Returns:
+    The decompressed bytes.
+
+  Raises:
+    ValueError: If the data can not be decompressed.
+  """
+  if compression_code == 0:
+    return data
+  if compression_code == COMPRESSIONS.index('zlib'):
+    import zlib
+    try:
+      return zlib.decompress(data)
+    except zlib.error as error:
+      raise ValueError('The encoded chunks are corrupt: %s' % error)
+  if compression_code == COMPRESSIONS.index('lz4'):
+    try:
+      import lz4.frame
+    except ImportError:
+      raise ValueError('lz4 is required to decode the chunks.')
+    try:
+      return lz4.frame.decompress(data)
+    except RuntimeError as error:
+      raise ValueError('The encoded chunks are corrupt: %s' % error)
+  raise ValueError('Unknown compression of the chunks.')
+
+
+def _escape_attribute(value):
+  """Escapes a string to be used as a double-quoted attribute value.
+
+  This is equivalent to `xml.sax.saxutils.escape` with the double quote
+  entity, which is not used since importing it costs more than the rest of
+  the module.
+
+  Args:
+    value: The attribute value (unicode).
+
+  Returns:
+    The escaped value (unicode).
+  """
+  return _escape_text(value).replace(u'"', u'&quot;')
+
+
+def _escape_text(value):
+  """Escapes text to be put in HTML code.
+
+  Args:
+    value: The text (unicode).
+
+  Returns:
+    The escaped text (unicode).
+  """
+  return (value.replace(u'&', u'&amp;').replace(u'<', u'&lt;')
+          .replace(u'>', u'&gt;'))
+
+
+def get_cache():
+  """Returns the cache shared by parsers, loading it on the first call.
+
+  Returns:
+    A BudouCache object.
+  """
+  global cache
+  if cache is None:
+    with _cache_lock:
+      if cache is None:
+        cache = cachefactory.load_cache()
+  return cache
+
+
+def get_credentials(json_path=None):
+  """Returns credentials scoped for Cloud Natural Language API.
+
+  If the credential file path is not given, this tries to generate credentials
+  from default settings.
+
+  Args:
+    json_path: A file path to a credential JSON file (string, optional).
+
+  Returns:
+    Scoped credentials.
+  """
+  import oauth2client.service_account
+  from oauth2client.client import GoogleCredentials
+  if json_path:
+    credentials = (
+        oauth2client.service_account.ServiceAccountCredentials
+        .from_json_keyfile_name(json_path))
+  else:
+    credentials = GoogleCredentials.get_application_default()
+  return credentials.create_scoped(
+      ['https://www.googleapis.com/auth/cloud-platform'])
+
+
+def get_discovery_document(path=None, http=None):
+  """Returns the discovery document of Natural Language API.
+
+  The document is looked up in memory, then in the local file. It is fetched
+  over the network only if neither has it, and then saved to the file so that
+  later processes can skip the request. A document which does not point at
+  the endpoint of the API is never used, since requests carry credentials.
+
+  Args:
+    path: A file path to cache the document, which defaults to a file in the
+    cache directory of the user (string, optional).
+    http: An httplib2.Http object to fetch the document (optional).
+
+  Returns:
+    The discovery document (string).
+
+  Raises:
+    ValueError: If the fetched document does not point at the API.
+  """
+  import os
+  import tempfile
+  if path is None:
+    path = os.path.join(_get_user_cache_dir(), DISCOVERY_CACHE_FILE_NAME)
+  with _discovery_lock:
+    document = _discovery_documents.get(path)
+    if document is not None:
+      return document
+    try:
+      with open(path, 'rb') as f:
+        document = f.read().decode('utf8')
+      _check_discovery_document(document)
+    except (IOError, OSError, ValueError):
+      document = _fetch_discovery_document(http)
+      _check_discovery_document(document)
+      try:
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        with os.fdopen(handle, 'wb') as f:
+          f.write(document.encode('utf8'))
+        # Replaces the file at once so that readers never see a partial one.
+        getattr(os, 'replace', os.rename)(temp_path, path)
+      except (IOError, OSError):
+        # The file is only an optimization, so the document is still usable.
+        pass
+    _discovery_documents[path] = document
+  return document
+
+
+def _get_user_cache_dir():
+  """Returns the cache directory of budou for the user, creating it if needed.
+
+  The directory is created accessible only by the user, so that other users
+  can not plant files in it.
+
+  Returns:
+    The path of the directory (string).
+  """
+  import os
+  base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+      os.path.expanduser('~'), '.cache')
+  directory = os.path.join(base, 'budou')
+  try:
+    os.makedirs(directory, 0o700)
+  except OSError:
+    # The directory exists, or the document is just not saved.
+    pass
+  return directory
+
+
+def _check_discovery_document(document):
+  """Checks that a discovery document points at Natural Language API.
+
+  Args:
+    document: The discovery document (string).
+
+  Raises:
+    ValueError: If the document is not JSON or points at another host.
+  """
+  import json
+  content = json.loads(document)
+  if not isinstance(content, dict):
+    raise ValueError('The discovery document is not an object.')
+  if content.get('rootUrl') != DISCOVERY_ROOT_URL or not content.get(
+      'baseUrl', DISCOVERY_ROOT_URL).startswith(DISCOVERY_ROOT_URL):
+    raise ValueError(
+        'The discovery document does not point at %s.' % DISCOVERY_ROOT_URL)
+
+
+def _fetch_discovery_document(http=None):
+  """Fetches the discovery document of Natural Language API.
+
+  Args:
+    http: An httplib2.Http object to fetch the document (optional).
+
+  Returns:
+    The discovery document (string).
+  """
+  from googleapiclient.errors import HttpError
+  import httplib2
+  if http is None:
     http = httplib2.Http()
-    scoped_credentials.authorize(http)
-    service = discovery.build('language', 'v1beta1', http=http)
-    return cls(service)
+  response, content = http.request(DISCOVERY_URL)
+  if response.status >= 400:
+    raise HttpError(response, content, uri=DISCOVERY_URL)
+  return content.decode('utf8')
 
-  def parse(self, source, attributes=None, use_cache=True, language='',
-            classname=DEFAULT_CLASS_NAME):
-    """Parses input HTML code into word chunks and organized code.
+
+def build_service(credentials=None, discovery_document=None):
+  """Builds a service for Natural Language API without the discovery request.
+
+  Args:
+    credentials: Credentials to authorize requests (optional).
+    discovery_document: The discovery document of the API, which defaults to
+    the one `get_discovery_document` returns (string, optional).
+
+  Returns:
+    A Resource object with methods for interacting with the service.
+  """
+  from googleapiclient import discovery
+  import httplib2
+  if discovery_document is None:
+    discovery_document = get_discovery_document()
+  http = httplib2.Http()
+  if credentials is not None:
+    http = credentials.authorize(http)
+  return discovery.build_from_document(discovery_document, http=http)
+
+
+class ServiceFactory(object):
+  """A function which returns services sharing the same credentials.
+
+  A service is not thread-safe, so each thread gets its own one. Parsers which
+  share the factory also share the service of each thread, and so its
+  credentials and kept-alive connections.
+
+  Attributes:
+    credentials: Credentials to authorize requests (optional).
+    discovery_document: The discovery document of the API (string, optional).
+  """
+
+  def __init__(self, credentials=None, discovery_document=None):
+    self.credentials = credentials
+    self.discovery_document = discovery_document
+    self._local = threading.local()
+
+  def __call__(self):
+    service = getattr(self._local, 'service', None)
+    if service is None:
+      service = build_service(self.credentials, self.discovery_document)
+      self._local.service = service
+    return service
+
+
+class BudouBase(object):
+  """A base of the parsers for CJK line break organizer.
+
+  This holds the configuration and the steps shared by `Budou` and
+  `AsyncBudou`, which send requests to Natural Language API in their own ways.
+
+  Attributes:
+    segmenter: A Segmenter to split text into source chunks locally instead of
+      calling Natural Language API for languages which have no segmenter in the
+      registry, or None to use the API (Segmenter).
+    segmenters: A registry of Segmenters keyed by language, which overrides
+      the default ones. A language mapped to None is sent to the API
+      (dictionary).
+    metrics: A MetricsCollector to report the timings of the stages, cache hits
+      and API usage to, or None to disable metrics (MetricsCollector).
+    cache_compression: The compression of chunks stored in the cache, which is
+      'zlib', 'lz4' or None (string).
+    cache: The BudouCache to store chunks in, SHARED_CACHE to use the cache
+      shared by parsers, or None to disable the cache (BudouCache).
+  """
+
+  def __init__(self, segmenter=None, segmenters=None, metrics=None,
+               cache_compression=DEFAULT_CACHE_COMPRESSION,
+               cache=SHARED_CACHE):
+    from .segmenter import DEFAULT_SEGMENTERS
+    self.segmenter = segmenter
+    self.segmenters = dict(DEFAULT_SEGMENTERS)
+    for language, language_segmenter in (segmenters or {}).items():
+      self.register_segmenter(language, language_segmenter)
+    self.metrics = metrics
+    self.cache_compression = cache_compression
+    self.cache = cache
+
+  def register_segmenter(self, language, segmenter):
+    """Registers a segmenter to process text in the language.
 
     Args:
-      source: HTML code to be processed (unicode).
-      attributes: If a dictionary, then a map of name-value pairs for attributes
-      of output SPAN tags. If a string, then this is the class name of output
-      SPAN tags. If an array, the elements will be joined together as the class
-      name of SPAN tags (dictionary|string, optional).
-      use_cache: Whether to use cache (boolean, optional).
-      language: A language used to parse text (string, optional).
+      language: A language code such as 'ja' or 'zh-TW' (string).
+      segmenter: A Segmenter, or None to send text in the language to Natural
+      Language API (Segmenter).
+    """
+    self.segmenters[language.lower()] = segmenter
+
+  def render(self, chunks, attributes=None, classname=DEFAULT_CLASS_NAME,
+             stream=None):
+    """Renders word chunks into HTML code with SPAN tags.
+
+    Args:
+      chunks: The list of word chunks, such as the chunks `parse` returns.
+      attributes: Attributes of output SPAN tags. See `parse` (dictionary|string,
+      optional).
+      classname: A class name of output SPAN tags (string, optional).
+      stream: A file-like object, such as io.StringIO, to write the HTML code
+      into (optional).
+
+    Returns:
+      The organized HTML code, or None if the stream is given.
+    """
+    attributes = self._get_attribute_dict(attributes, classname)
+    return self._spanize(chunks, attributes, stream)
+
+  def _get_result(self, chunks, attributes, classname=None):
+    """Renders the chunks into HTML code and builds the result value.
+
+    Args:
+      chunks: The list of word chunks with HTML elements migrated.
+      attributes: Attributes of output SPAN tags (dictionary|string).
       classname: A class name of output SPAN tags (string, optional).
-      **This argument is deprecated. Please use attributes arg instead.
-      When specified with the attributes arg, the class name in the attributes
-      arg will be used.**
 
     Returns:
       A dictionary with the list of word chunks and organized HTML code.
     """
-    if use_cache:
-      result_value = cache.get(source, language)
-      if result_value: return result_value
-    source = self._preprocess(source)
-    dom = html.fragment_fromstring(source, create_parent='body')
-    input_text = dom.text_content()
-    if language == 'ko':
-      chunks = self._get_chunks_per_space(input_text)
-    else:
-      chunks = self._get_chunks_with_api(input_text, language)
-    chunks = self._migrate_html(chunks, dom)
     attributes = self._get_attribute_dict(attributes, classname)
     html_code = self._spanize(chunks, attributes)
-    result_value = {
-        'chunks': chunks,
+    return {
+        'chunks': list(chunks),
         'html_code': html_code
     }
-    if use_cache:
-      cache.set(source, language, result_value)
-    return result_value
+
+  def _get_dom(self, source):
+    """Returns the DOM of the given HTML code.
+
+    Args:
+      source: Preprocessed HTML code (unicode).
+
+    Returns:
+      DOM to access the given HTML source.
+    """
+    return html.fragment_fromstring(source, create_parent='body')
 
   def _get_chunks_per_space(self, input_text):
     """Returns a list of chunks by separating words by spaces.
@@ -142,27 +655,46 @@ class Budou(object):
     Returns:
       A list of Chunks.
     """
-    chunks = []
-    for word in input_text.split():
-      chunks.append(Chunk(word, None, None, True))
-      chunks.append(Chunk(u' ', SPACE_POS, SPACE_POS, True))
-    return chunks[:-1]
+    from .segmenter import SpaceSegmenter
+    return SpaceSegmenter().segment(input_text)
 
-  def _get_chunks_with_api(self, input_text, language):
-    """Returns a list of chunks by using Natural Language API.
+  def _get_segmenter(self, input_text, language):
+    """Returns the segmenter to process the text with.
+
+    The registry is looked up with the language, then with its primary subtag
+    such as 'zh' for 'zh-TW'. If the language is not given, it is detected from
+    the scripts used in the text.
 
     Args:
       input_text: String to parse.
-      language: A language used to parse text (string, optional).
+      language: A language used to parse text (string).
+
+    Returns:
+      A tuple of the Segmenter, or None if the text should be sent to Natural
+      Language API, and the language passed to the segmenter.
+    """
+    from .segmenter import detect_language
+    language = (language or detect_language(input_text)).lower()
+    for key in (language, language.split('-')[0]):
+      if key in self.segmenters:
+        return self.segmenters[key], language
+    return self.segmenter, language
+
+  def _get_chunks_with_segmenter(self, segmenter, input_text, language):
+    """Returns a list of chunks by using the segmenter.
+
+    Args:
+      segmenter: A Segmenter.
+      input_text: String to parse.
+      language: A language used to parse text (string).
 
     Returns:
       A list of Chunks.
     """
-    chunks = self._get_source_chunks(input_text, language)
-    chunks = self._concatenate_punctuations(chunks)
-    chunks = self._concatenate_by_label(chunks, True)
-    chunks = self._concatenate_by_label(chunks, False)
-    return chunks
+    with self._measure('segment'):
+      chunks = segmenter.segment(input_text, language)
+    with self._measure('concatenate'):
+      return self._concatenate_chunks(chunks)
 
   def _get_attribute_dict(self, attributes, classname=None):
     """Returns a dictionary of attribute name-value pairs.
@@ -187,8 +719,176 @@ class Budou(object):
     attributes.setdefault('class', classname)
     return attributes
 
-  def _get_annotations(self, text, language='', encoding='UTF32'):
-    """Returns the list of annotations from the given text."""
+  def _count_annotation(self, text, tokens):
+    """Reports the usage of Natural Language API by a request.
+
+    Args:
+      text: The text sent to the API (unicode).
+      tokens: The tokens returned by the API (list).
+    """
+    if self.metrics is None: return
+    self.metrics.increment('api.requests')
+    self.metrics.increment('api.bytes', len(text.encode('utf8')))
+    self.metrics.increment('api.tokens', len(tokens))
+
+  def _get_cached_chunks(self, input_text, language):
+    """Returns the chunks of the text in the cache and reports hit or miss.
+
+    Args:
+      input_text: String to look up.
+      language: A language used to parse text (string).
+
+    Returns:
+      A list of Chunks, or None if the text is not in the cache.
+    """
+    return self._get_many_cached_chunks([input_text], language)[0]
+
+  def _get_many_cached_chunks(self, input_texts, language):
+    """Returns the chunks of the texts in the cache in a single lookup.
+
+    Texts are looked up in a single call for each engine which parses them.
+
+    Args:
+      input_texts: A list of strings to look up.
+      language: A language used to parse text (string).
+
+    Returns:
+      A list of lists of Chunks in the same order as the texts, in which None
+      stands for a text not in the cache.
+    """
+    if not input_texts: return []
+    cache = self._get_cache()
+    if cache is None: return [None] * len(input_texts)
+    result = {}
+    for cache_language, texts in self._group_by_cache_language(
+        input_texts, language).items():
+      result.update(zip(texts, [
+          self._decode_chunks(value)
+          for value in cache.get_many(texts, cache_language)]))
+    result = [result[input_text] for input_text in input_texts]
+    if self.metrics is not None:
+      misses = sum(1 for chunks in result if chunks is None)
+      tags = {'backend': type(cache).__name__}
+      if len(result) > misses:
+        self.metrics.increment('cache.hit', len(result) - misses, tags=tags)
+      if misses:
+        self.metrics.increment('cache.miss', misses, tags=tags)
+    return result
+
+  def _set_cached_chunks(self, input_text, language, chunks):
+    """Stores the chunks of the text in the cache.
+
+    Args:
+      input_text: String parsed into the chunks.
+      language: A language used to parse text (string).
+      chunks: A list of Chunks.
+    """
+    self._set_many_cached_chunks({input_text: chunks}, language)
+
+  def _set_many_cached_chunks(self, text_chunks, language):
+    """Stores the chunks of the texts in the cache in a single write.
+
+    Args:
+      text_chunks: A dictionary of lists of Chunks keyed by the parsed strings.
+      language: A language used to parse text (string).
+    """
+    cache = self._get_cache()
+    if cache is None: return
+    for cache_language, texts in self._group_by_cache_language(
+        list(text_chunks), language).items():
+      cache.set_many(
+          dict((input_text, self._encode_chunks(text_chunks[input_text]))
+               for input_text in texts), cache_language)
+
+  def _get_cache_language(self, input_text, language):
+    """Returns the language the chunks of the text are cached under.
+
+    The language is qualified with the engine which parses the text, the class
+    name of the segmenter or 'api', so that parsers with different segmenters
+    never share chunks.
+
+    Args:
+      input_text: String to parse.
+      language: A language used to parse text (string).
+
+    Returns:
+      The language for the cache (string).
+    """
+    segmenter, _ = self._get_segmenter(input_text, language)
+    engine = 'api' if segmenter is None else type(segmenter).__name__
+    return '%s:%s' % (language, engine)
+
+  def _group_by_cache_language(self, input_texts, language):
+    """Groups texts by the language their chunks are cached under.
+
+    Args:
+      input_texts: A list of strings.
+      language: A language used to parse text (string).
+
+    Returns:
+      A dictionary of lists of the texts keyed by the language for the cache.
+    """
+    groups = collections.OrderedDict()
+    for input_text in input_texts:
+      groups.setdefault(
+          self._get_cache_language(input_text, language), []).append(input_text)
+    return groups
+
+  def _get_cache(self):
+    """Returns the cache of the parser.
+
+    Returns:
+      A BudouCache object, or None if the cache is disabled.
+    """
+    if self.cache is SHARED_CACHE:
+      return get_cache()
+    return self.cache
+
+  def _encode_chunks(self, chunks):
+    """Encodes chunks into the compact form stored in the cache.
+
+    Args:
+      chunks: A list of Chunks.
+
+    Returns:
+      The encoded chunks (bytes).
+    """
+    if not isinstance(chunks, ChunkList):
+      chunks = ChunkList(chunks)
+    return chunks.to_bytes(self.cache_compression)
+
+  def _decode_chunks(self, value):
+    """Decodes chunks read from the cache.
+
+    A value which can not be decoded, such as one written by a version of
+    budou with another format, is treated as missing.
+
+    Args:
+      value: The value read from the cache (bytes).
+
+    Returns:
+      A ChunkList, or None if the value is missing or can not be decoded.
+    """
+    if value is None: return None
+    try:
+      return ChunkList.from_bytes(value)
+    except ValueError:
+      return None
+
+  def _measure(self, name):
+    """Returns a context manager which reports the time taken by a stage.
+
+    Args:
+      name: The name of the stage (string).
+
+    Returns:
+      A context manager, which does nothing if metrics are disabled.
+    """
+    if self.metrics is None: return NULL_TIMER
+    return Timer(self.metrics, name)
+
+  def _get_annotation_body(self, text, language='', encoding='UTF32'):
+    """Returns the body of an annotateText request for the given text."""
     body = {
         'document': {
             'type': 'PLAIN_TEXT',
@@ -202,10 +902,7 @@ class Budou(object):
 
     if language:
       body['document']['language'] = language
-
-    request = self.service.documents().annotateText(body=body)
-    response = request.execute()
-    return response.get('tokens', [])
+    return body
 
   def _preprocess(self, source):
     """Removes unnecessary break lines and whitespaces.
@@ -221,36 +918,38 @@ class Budou(object):
     source = re.sub(r'\s\s+', u' ', source)
     return source
 
-  def _get_source_chunks(self, input_text, language=''):
-    """Returns the words chunks.
+  def _get_chunks_from_tokens(self, tokens):
+    """Returns the word chunks from the tokens returned by the API.
 
     Args:
-      input_text: An input text to annotate (unicode).
-      language: A language used to parse text (string).
+      tokens: The list of tokens (list).
 
     Returns:
       A list of word chunk objects (list).
     """
     chunks = []
     sentence_length = 0
-    tokens = self._get_annotations(input_text, language)
-    for token in tokens:
+    for i, token in enumerate(tokens):
       word = token['text']['content']
       begin_offset = token['text']['beginOffset']
-      label = token['dependencyEdge']['label']
+      dependency_edge = token['dependencyEdge']
       pos = token['partOfSpeech']['tag']
       if begin_offset > sentence_length:
         chunks.append(Chunk(u' ', SPACE_POS, SPACE_POS, True))
         sentence_length = begin_offset
       chunks.append(Chunk(
-          word, pos, label,
-          tokens.index(token) < token['dependencyEdge']['headTokenIndex']))
+          word, pos, dependency_edge['label'],
+          i < dependency_edge['headTokenIndex']))
       sentence_length += len(word)
     return chunks
 
   def _migrate_html(self, chunks, dom):
     """Migrates HTML elements to the word chunks by bracketing each element.
 
+    Chunks and elements are swept together in the order of their offsets. The
+    chunks which overlap an element are merged into a single chunk, in which
+    the text of the element is replaced with its HTML source.
+
     Args:
       chunks: The list of word chunks to be processed.
       dom: DOM to access the given HTML source.
@@ -259,31 +958,65 @@ class Budou(object):
       A list of processed word chunks.
     """
     elements = self._get_elements_list(dom)
+    if not elements: return chunks
+    result = []
+    group = []
+    group_elements = []
+    group_begin = 0
+    group_end = 0
+    element_index = 0
+    index = 0
+    for chunk in chunks:
+      if not group: group_begin = index
+      group.append(chunk)
+      index += len(chunk.word)
+      while (element_index < len(elements) and
+             elements[element_index].index < index):
+        element = elements[element_index]
+        group_elements.append(element)
+        group_end = max(group_end, element.index + len(element.text))
+        element_index += 1
+      if group_end > index: continue
+      if group_elements:
+        result.append(self._merge_elements(group, group_elements, group_begin))
+      else:
+        result.extend(group)
+      group = []
+      group_elements = []
+    if group_elements:
+      result.append(self._merge_elements(group, group_elements, group_begin))
+    elif group:
+      result.extend(group)
+    if element_index < len(elements) and result:
+      # Elements without text at the end of the source.
+      last_chunk = result.pop()
+      result.append(self._merge_elements(
+          [last_chunk], elements[element_index:],
+          index - len(last_chunk.word)))
+    return result
+
+  def _merge_elements(self, chunks, elements, index):
+    """Merges the chunks into a chunk with the HTML sources of the elements.
+
+    Args:
+      chunks: The list of word chunks which overlap the elements.
+      elements: The list of elements in the order of their offsets.
+      index: Character-wise offset of the first chunk (number).
+
+    Returns:
+      A chunk with the HTML sources of the elements, in which the text out of
+      the elements is escaped.
+    """
+    word = u''.join([chunk.word for chunk in chunks])
+    pieces = []
+    cursor = 0
     for element in elements:
-      result = []
-      index = 0
-      concat_chunks = []
-      for chunk in chunks:
-        if (index + len(chunk.word) <= element.index or
-            element.index + len(element.text) <= index):
-          result.append(chunk)
-        elif (index <= element.index and
-              element.index + len(element.text) <= index + len(chunk.word)):
-          result.append(Chunk(
-              chunk.word.replace(element.text, element.source),
-              HTML_POS, HTML_POS, True))
-        elif (index < element.index + len(element.text) and
-              element.index + len(element.text) <= index + len(chunk.word)):
-          concat_chunks.append(chunk)
-          new_word = u''.join([c_chunk.word for c_chunk in concat_chunks])
-          new_word = new_word.replace(element.text, element.source)
-          result.append(Chunk(new_word, HTML_POS, HTML_POS, True))
-          concat_chunks = []
-        else:
-          concat_chunks.append(chunk)
-        index += len(chunk.word)
-      chunks = result
-    return chunks
+      begin = element.index - index
+      pieces.append(_escape_text(word[cursor:begin]))
+      pieces.append(element.source)
+      cursor = begin + len(element.text)
+    pieces.append(_escape_text(word[cursor:]))
+    return Chunk(u''.join(pieces), HTML_POS, HTML_POS, True)
 
   def _get_elements_list(self, dom):
     """Digs DOM to the first depth and returns the list of elements.
@@ -309,28 +1042,147 @@ class Budou(object):
       if element.tail: index += len(element.tail)
     return result
 
-  def _spanize(self, chunks, attributes):
+  def _spanize(self, chunks, attributes, stream=None):
     """Returns concatenated HTML code with SPAN tag.
 
+    The words of chunks are escaped, except for the chunks of HTML_POS which
+    already hold HTML code.
+
     Args:
       chunks: The list of word chunks.
-      attributes: If a dictionary, then a map of name-value pairs for attributes
-      of output SPAN tags. If a string, then this is the class name of output
-      SPAN tags. If an array, the elements will be joined together as the
-      class name of SPAN tags.
+      attributes: A map of name-value pairs for attributes of output SPAN tags
+      (dictionary).
+      stream: A file-like object to write the HTML code into (optional).
 
     Returns:
-      The organized HTML code.
+      The organized HTML code, or None if the stream is given.
     """
-    result = []
+    open_tag = u'<span %s>' % u' '.join(
+        u'%s="%s"' % (k, _escape_attribute(six.text_type(v)))
+        for k, v in sorted(attributes.items()))
+    if stream is None:
+      result = []
+      write = result.append
+    else:
+      write = stream.write
     for chunk in chunks:
       if chunk.pos == SPACE_POS:
-        result.append(chunk.word)
+        write(chunk.word)
+      elif chunk.pos == HTML_POS:
+        write(open_tag + chunk.word + u'</span>')
       else:
-        attribute_str = ' '.join(
-            '%s="%s"' % (k, v) for k, v in sorted(attributes.items()))
-        result.append('<span %s>%s</span>' % (attribute_str, chunk.word))
-    return ''.join(result)
+        write(open_tag + _escape_text(chunk.word) + u'</span>')
+    if stream is None:
+      return u''.join(result)
+
+  def _concatenate_chunks(self, chunks):
+    """Concatenates punctuation marks and dependent words into chunks.
+
+    This gives the same result as `_concatenate_punctuations` followed by
+    `_concatenate_by_label` in both directions, but streams the chunks through
+    the three steps in a single pass. Words are carried as lists and joined
+    only once for each output chunk.
+
+    Args:
+      chunks: The list of word chunks.
+
+    Returns:
+      The processed word chunks.
+    """
+    items = (([chunk.word], chunk.pos, chunk.label, chunk.forward)
+             for chunk in chunks)
+    items = self._concatenate_punctuation_items(items)
+    items = self._concatenate_forward_items(items)
+    items = self._concatenate_backward_items(items)
+    return [Chunk(u''.join(words), pos, label, forward)
+            for words, pos, label, forward in items]
+
+  def _concatenate_punctuation_items(self, items):
+    """Appends punctuation marks to the preceding items.
+
+    Args:
+      items: An iterable of (words, pos, label, forward) tuples.
+
+    Yields:
+      The processed (words, pos, label, forward) tuples.
+    """
+    head = None
+    for item in items:
+      if item[1] == u'PUNCT':
+        if head is None:
+          yield item
+        else:
+          head[0].extend(item[0])
+        continue
+      if head is not None: yield head
+      head = item
+    if head is not None: yield head
+
+  def _concatenate_forward_items(self, items):
+    """Prepends items which depend on the following words to the next item.
+
+    Args:
+      items: An iterable of (words, pos, label, forward) tuples.
+
+    Yields:
+      The processed (words, pos, label, forward) tuples.
+    """
+    bucket = []
+    for item in items:
+      words, pos, label, forward = item
+      if ((label in TARGET_LABEL and forward == True) or
+          (bucket and label == SPACE_POS)):
+        bucket.append(item)
+        continue
+      if bucket:
+        merged_words = []
+        for bucket_item in bucket:
+          merged_words.extend(bucket_item[0])
+        merged_words.extend(words)
+        item = (merged_words, pos, label, forward)
+        bucket = []
+      yield item
+    for item in bucket:
+      yield item
+
+  def _concatenate_backward_items(self, items):
+    """Appends items which depend on the preceding words to the previous item.
+
+    Spaces are held until the next item shows whether they are followed by a
+    dependent item, in which case they are appended together.
+
+    Args:
+      items: An iterable of (words, pos, label, forward) tuples.
+
+    Yields:
+      The processed (words, pos, label, forward) tuples.
+    """
+    head = None
+    spaces = []
+    for item in items:
+      words, pos, label, forward = item
+      if label in TARGET_LABEL and forward == False:
+        if head is None:
+          for space in spaces:
+            yield space
+          yield item
+        else:
+          for space in spaces:
+            head[0].extend(space[0])
+          head[0].extend(words)
+        spaces = []
+        continue
+      if label == SPACE_POS:
+        spaces.append(item)
+        continue
+      if head is not None: yield head
+      for space in spaces:
+        yield space
+      spaces = []
+      head = item
+    if head is not None: yield head
+    for space in spaces:
+      yield space
 
   def _concatenate_punctuations(self, chunks):
     """Concatenates chunks backword if they are punctuation marks.
@@ -385,3 +1237,625 @@ class Budou(object):
     if tmp_bucket: result += tmp_bucket
     if not forward: result = result[::-1]
     return result
+
+
+class Budou(BudouBase):
+  """A parser for CJK line break organizer.
+
+  Attributes:
+    service: A Resource object with methods for interacting with the service.
+    service_factory: A function which returns a new Resource object. Threads
+      other than the one which created the parser use their own services built
+      by this function, since a service is not thread-safe. Without it,
+      `parse_many` parses serially (function).
+    num_retries: The number of times to retry a failed API request with
+      randomized exponential backoff (number).
+
+  The other attributes are described in `BudouBase`.
+  """
+
+  def __init__(self, service, service_factory=None,
+               num_retries=DEFAULT_NUM_RETRIES,
+               segmenter=None, segmenters=None, metrics=None,
+               cache_compression=DEFAULT_CACHE_COMPRESSION,
+               cache=SHARED_CACHE):
+    super(Budou, self).__init__(
+        segmenter=segmenter, segmenters=segmenters, metrics=metrics,
+        cache_compression=cache_compression, cache=cache)
+    self.service = service
+    self.service_factory = service_factory
+    self.num_retries = num_retries
+    self._thread = threading.current_thread()
+    self._local = threading.local()
+
+  @classmethod
+  def authenticate(cls, json_path=None, num_retries=DEFAULT_NUM_RETRIES,
+                   service_factory=None,
+                   discovery_document=None, cache=SHARED_CACHE):
+    """Authenticates user for Cloud Natural Language API and returns the parser.
+
+    If the credential file path is not given, this tries to generate credentials
+    from default settings. The service is built from the discovery document
+    cached in a local file, so the document is fetched only once per machine.
+
+    Args:
+      json_path: A file path to a credential JSON file for a Google Cloud
+      Project which Cloud Natural Language API is enabled (string, optional).
+      num_retries: The number of times to retry a failed API request (number,
+      optional).
+      service_factory: A ServiceFactory shared with other parsers, in which
+      case json_path is ignored (ServiceFactory, optional).
+      discovery_document: The discovery document of the API (string,
+      optional).
+      cache: The cache of the parser. See `Budou` (BudouCache, optional).
+
+    Returns:
+      Budou module.
+    """
+    if service_factory is None:
+      service_factory = ServiceFactory(
+          get_credentials(json_path), discovery_document)
+    return cls(service_factory(), service_factory=service_factory,
+               num_retries=num_retries, cache=cache)
+
+  def parse(self, source, attributes=None, use_cache=True, language='',
+            classname=DEFAULT_CLASS_NAME):
+    """Parses input HTML code into word chunks and organized code.
+
+    Args:
+      source: HTML code to be processed (unicode).
+      attributes: If a dictionary, then a map of name-value pairs for attributes
+      of output SPAN tags. If a string, then this is the class name of output
+      SPAN tags. If an array, the elements will be joined together as the class
+      name of SPAN tags (dictionary|string, optional).
+      use_cache: Whether to use cache (boolean, optional).
+      language: A language used to parse text (string, optional).
+      classname: A class name of output SPAN tags (string, optional).
+      **This argument is deprecated. Please use attributes arg instead.
+      When specified with the attributes arg, the class name in the attributes
+      arg will be used.**
+
+    Returns:
+      A dictionary with the list of word chunks and organized HTML code.
+    """
+    with self._measure('parse'):
+      with self._measure('preprocess'):
+        source = self._preprocess(source)
+      with self._measure('dom'):
+        dom = self._get_dom(source)
+      input_text = dom.text_content()
+      chunks = None
+      if use_cache:
+        chunks = self._get_cached_chunks(input_text, language)
+      if chunks is None:
+        chunks = self._get_chunks(input_text, language)
+        if use_cache:
+          self._set_cached_chunks(input_text, language, chunks)
+      with self._measure('migrate_html'):
+        chunks = self._migrate_html(chunks, dom)
+      with self._measure('render'):
+        return self._get_result(chunks, attributes, classname)
+
+  def parse_many(self, sources, attributes=None, use_cache=True, language='',
+                 classname=DEFAULT_CLASS_NAME, max_workers=DEFAULT_MAX_WORKERS):
+    """Parses a list of HTML fragments concurrently in a pool of threads.
+
+    Each thread sends its API requests through its own service built by the
+    service factory. Failed requests are retried up to `num_retries` times.
+    A parser with a service but without a service factory parses the sources
+    one by one in the calling thread, since its service is not thread-safe.
+
+    Args:
+      sources: A list of HTML code to be processed (list of unicode).
+      attributes: Attributes of output SPAN tags. See `parse` (dictionary|string,
+      optional).
+      use_cache: Whether to use cache (boolean, optional).
+      language: A language used to parse text (string, optional).
+      classname: A class name of output SPAN tags (string, optional).
+      max_workers: The maximum number of threads (number, optional).
+
+    Returns:
+      A list of dictionaries in the same order as the sources, each of which
+      has the same form as the one `parse` returns.
+    """
+    attributes = self._get_attribute_dict(attributes, classname)
+    if self.service is not None and self.service_factory is None:
+      return [self.parse(source, attributes, use_cache, language)
+              for source in sources]
+    from concurrent import futures
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+      return list(executor.map(
+          lambda source: self.parse(source, attributes, use_cache, language),
+          sources))
+
+  def parse_stream(self, source, attributes=None, use_cache=True, language='',
+                   classname=DEFAULT_CLASS_NAME,
+                   batch_size=DEFAULT_STREAM_BATCH_SIZE):
+    """Parses a long HTML document piece by piece with bounded memory.
+
+    The input is split into windows at block elements and at the ends of
+    sentences and lines which are not inside any inline element, and the
+    windows are parsed in batches by `parse_batch`. Block tags, the head and
+    the declarations of a whole document are passed through as they are, so
+    joining the yielded HTML code gives the organized HTML code of the whole
+    document.
+
+    Args:
+      source: An iterable of HTML code, such as a file object or a list of
+      strings, or a string (iterable of unicode|unicode).
+      attributes: Attributes of output SPAN tags. See `parse` (dictionary|string,
+      optional).
+      use_cache: Whether to use cache (boolean, optional).
+      language: A language used to parse text (string, optional).
+      classname: A class name of output SPAN tags (string, optional).
+      batch_size: The number of windows and pieces of markup handled at once
+      (number, optional).
+
+    Yields:
+      Organized HTML code of each window and markup (unicode).
+    """
+    if isinstance(source, (six.text_type, six.binary_type)):
+      source = [source]
+    attributes = self._get_attribute_dict(attributes, classname)
+    items = []
+    after_markup = True
+    for item in self._split_windows(source):
+      items.append(item)
+      if len(items) < batch_size: continue
+      for html_code in self._parse_windows(
+          items, attributes, use_cache, language, after_markup):
+        yield html_code
+      after_markup = not items[-1][1]
+      items = []
+    for html_code in self._parse_windows(
+        items, attributes, use_cache, language, after_markup):
+      yield html_code
+
+  def _parse_windows(self, items, attributes, use_cache, language,
+                     after_markup):
+    """Parses the windows of text and yields them along with the markup.
+
+    Preprocessing strips the whitespace at the start of each window, so a space
+    is put back in front of the windows which started with one, unless they
+    start a block.
+
+    Args:
+      items: A list of tuples of HTML code and whether it is a window of text
+      (list of tuples).
+      attributes: Attributes of output SPAN tags (dictionary).
+      use_cache: Whether to use cache (boolean).
+      language: A language used to parse text (string).
+      after_markup: Whether the items follow markup or the start of the
+      document (boolean).
+
+    Yields:
+      Organized HTML code of each window and markup (unicode).
+    """
+    windows = [window for window, is_text in items if is_text]
+    if not items: return
+    results = iter(self.parse_batch(windows, attributes, use_cache, language)
+                   if windows else [])
+    for window, is_text in items:
+      if not is_text:
+        yield window
+        after_markup = True
+        continue
+      html_code = next(results)['html_code']
+      if not after_markup and window.replace(u'\n', u'')[:1].isspace():
+        yield u' ' + html_code
+      else:
+        yield html_code
+      after_markup = False
+
+  def _split_windows(self, source):
+    """Splits HTML code into windows of text and pieces of markup.
+
+    Windows are split at the ends of sentences and lines outside inline
+    elements, so that each of them is a well-formed HTML fragment. Tags of
+    block elements, declarations, comments and elements such as the head and
+    scripts end windows and are returned as markup. Since every block tag ends
+    a window, omitted end tags such as those of P and LI are harmless. Blank
+    windows are merged into the next window, or returned as markup before
+    other markup.
+
+    Args:
+      source: An iterable of HTML code (iterable of unicode).
+
+    Yields:
+      Tuples of HTML code and whether it is a window of text to be parsed
+      (unicode, boolean).
+    """
+    depth = 0
+    verbatim = None
+    window = []
+    pending = u''
+    # Bytes are decoded across pieces, which may split a character.
+    decoder = codecs.getincrementaldecoder('utf8')()
+    for data in source:
+      if isinstance(data, six.binary_type):
+        data = decoder.decode(data)
+      pending += data
+      # Holds back a tag or a comment which is not closed yet until the next
+      # data arrives.
+      cut = self._find_incomplete_markup(pending)
+      scannable, pending = pending[:cut], pending[cut:]
+      begin = 0
+      for match in WINDOW_BOUNDARY_RE.finditer(scannable):
+        name = (match.group('name') or '').lower()
+        is_close = bool(match.group('close'))
+        if verbatim is not None:
+          # Passes the content through until the element ends. The start of
+          # the body ends the head, whose end tag is optional.
+          if not match.group('tag'): continue
+          if name == verbatim and is_close:
+            end = match.end()
+          elif verbatim == 'head' and name == 'body' and not is_close:
+            end = match.start()
+          else:
+            continue
+          window.append(scannable[begin:end])
+          begin = end
+          yield u''.join(window), False
+          window = []
+          verbatim = None
+          if end == match.end(): continue
+        if not match.group('tag'):
+          if depth > 0: continue
+          window.append(scannable[begin:match.end()])
+          begin = match.end()
+          window_source = u''.join(window)
+          if window_source.strip():
+            yield window_source, True
+            window = []
+          else:
+            window = [window_source]
+          continue
+        if not (name in BLOCK_ELEMENTS or name in VERBATIM_ELEMENTS or
+                not name and depth == 0):
+          if name and name not in VOID_ELEMENTS and not match.group(
+              'self_close'):
+            depth = max(depth - 1, 0) if is_close else depth + 1
+          continue
+        window.append(scannable[begin:match.start()])
+        window_source = u''.join(window)
+        if window_source:
+          yield window_source, bool(window_source.strip())
+        window = []
+        begin = match.end()
+        depth = 0
+        if (name in VERBATIM_ELEMENTS and name not in VOID_ELEMENTS and
+            not is_close and not match.group('self_close')):
+          verbatim = name
+          window.append(match.group())
+        else:
+          yield match.group(), False
+      window.append(scannable[begin:])
+    window.append(pending + decoder.decode(b'', True))
+    window_source = u''.join(window)
+    if window_source:
+      yield window_source, verbatim is None and bool(window_source.strip())
+
+  def _find_incomplete_markup(self, source):
+    """Returns the offset of a tag or a comment which is not closed yet.
+
+    Args:
+      source: HTML code (unicode).
+
+    Returns:
+      The offset of the incomplete markup, or the length of the code if all
+      markup is complete (number).
+    """
+    index = source.find(u'<')
+    while index >= 0:
+      if source.startswith(u'<!--', index):
+        end = source.find(u'-->', index + 4)
+        if end < 0: return index
+        index = source.find(u'<', end + 3)
+      elif u'<!--'.startswith(source[index:]):
+        # The start of a comment may be split.
+        return index
+      elif re.match(u'<[a-zA-Z/!?]', source[index:index + 2]):
+        end = source.find(u'>', index)
+        if end < 0: return index
+        index = source.find(u'<', end + 1)
+      else:
+        index = source.find(u'<', index + 1)
+    return len(source)
+
+  def parse_document(self, source, attributes=None, use_cache=True,
+                     language='', classname=DEFAULT_CLASS_NAME, selector=None,
+                     xpath=DEFAULT_BLOCK_XPATH, max_bytes=MAX_BATCH_BYTES):
+    """Parses the text-bearing blocks of a whole HTML document.
+
+    The content of each block selected by the CSS selector or the XPath is
+    processed as an HTML fragment, and the document is serialized once at the
+    end. In a block which contains other selected blocks, the runs of content
+    around them are processed, and the inner blocks are processed on their
+    own. Runs with the same content are parsed only once, and all runs are
+    parsed by `parse_batch`.
+
+    Args:
+      source: HTML code of the document (unicode).
+      attributes: Attributes of output SPAN tags. See `parse` (dictionary|string,
+      optional).
+      use_cache: Whether to use cache (boolean, optional).
+      language: A language used to parse text (string, optional).
+      classname: A class name of output SPAN tags (string, optional).
+      selector: A CSS selector to select blocks, which requires the cssselect
+      package. Overrides the XPath if given (string, optional).
+      xpath: An XPath to select blocks (string, optional).
+      max_bytes: The maximum size of the text sent in a single request in
+      bytes (number, optional).
+
+    Returns:
+      A dictionary with the lists of Chunks of the processed runs in the
+      order of the blocks and organized HTML code of the document.
+    """
+    document = html.document_fromstring(source)
+    if selector:
+      from lxml.cssselect import CSSSelector
+      blocks = CSSSelector(selector)(document)
+    else:
+      blocks = document.xpath(xpath)
+    containers = set()
+    for block in blocks:
+      containers.update(block.iterancestors())
+    boundaries = containers.union(blocks)
+    # Each run is the content of a block between the children which are or
+    # contain selected blocks: the block, the child before the run or None,
+    # the text at the start and the children in the run.
+    runs = []
+    for block in blocks:
+      run = (block, None, block.text or u'', [])
+      for child in block:
+        if child in boundaries:
+          runs.append(run)
+          run = (block, child, child.tail or u'', [])
+        else:
+          run[3].append(child)
+      runs.append(run)
+    runs = [run for run in runs if (run[2] + u''.join(
+        child.text_content() + (child.tail or u'') for child in run[3])).strip()]
+    run_sources = [_escape_text(text) + u''.join(
+        html.tostring(child, encoding='unicode') for child in children)
+                   for _, _, text, children in runs]
+    unique_sources = list(collections.OrderedDict.fromkeys(run_sources))
+    results = dict(zip(unique_sources, self.parse_batch(
+        unique_sources, attributes, use_cache, language, classname,
+        max_bytes)))
+    for (block, previous, _, children), run_source in zip(runs, run_sources):
+      fragment = html.fragment_fromstring(
+          results[run_source]['html_code'], create_parent='div')
+      for child in children:
+        block.remove(child)
+      if previous is None:
+        block.text = fragment.text
+        index = 0
+      else:
+        previous.tail = fragment.text
+        index = block.index(previous) + 1
+      for offset, child in enumerate(list(fragment)):
+        block.insert(index + offset, child)
+    if DOCTYPE_RE.match(source):
+      html_code = html.tostring(
+          document, encoding='unicode',
+          doctype=document.getroottree().docinfo.doctype)
+    else:
+      html_code = html.tostring(document, encoding='unicode')
+    return {
+        'chunks': [results[run_source]['chunks'] for run_source in run_sources],
+        'html_code': html_code,
+    }
+
+  def parse_batch(self, sources, attributes=None, use_cache=True, language='',
+                  classname=DEFAULT_CLASS_NAME, max_bytes=MAX_BATCH_BYTES):
+    """Parses a list of HTML fragments with as few API requests as possible.
+
+    The texts of the fragments are joined into packs that fit in the request
+    size limit, and each pack is annotated with a single API request. Fragments
+    found in the cache are not sent to the API.
+
+    Args:
+      sources: A list of HTML code to be processed (list of unicode).
+      attributes: Attributes of output SPAN tags. See `parse` (dictionary|string,
+      optional).
+      use_cache: Whether to use cache (boolean, optional).
+      language: A language used to parse text (string, optional).
+      classname: A class name of output SPAN tags (string, optional).
+      max_bytes: The maximum size of the text sent in a single request in
+      bytes (number, optional).
+
+    Returns:
+      A list of dictionaries in the same order as the sources, each of which
+      has the same form as the one `parse` returns.
+    """
+    with self._measure('preprocess'):
+      sources = [self._preprocess(source) for source in sources]
+    with self._measure('dom'):
+      doms = [self._get_dom(source) for source in sources]
+    input_texts = [dom.text_content() for dom in doms]
+    unique_texts = list(collections.OrderedDict.fromkeys(input_texts))
+    if use_cache:
+      cached_chunks = self._get_many_cached_chunks(unique_texts, language)
+    else:
+      cached_chunks = [None] * len(unique_texts)
+    text_chunks = dict(zip(unique_texts, cached_chunks))
+    pending_texts = [
+        input_text for input_text, chunks in zip(unique_texts, cached_chunks)
+        if chunks is None]
+    api_texts = []
+    for input_text in pending_texts:
+      segmenter, text_language = self._get_segmenter(input_text, language)
+      if segmenter is None:
+        api_texts.append(input_text)
+      else:
+        text_chunks[input_text] = self._get_chunks_with_segmenter(
+            segmenter, input_text, text_language)
+    api_chunks = self._get_chunks_with_api_batch(api_texts, language, max_bytes)
+    text_chunks.update(zip(api_texts, api_chunks))
+    if use_cache and pending_texts:
+      self._set_many_cached_chunks(
+          dict((input_text, text_chunks[input_text])
+               for input_text in pending_texts), language)
+    attributes = self._get_attribute_dict(attributes, classname)
+    with self._measure('migrate_html'):
+      chunk_lists = [self._migrate_html(text_chunks[input_text], dom)
+                     for input_text, dom in zip(input_texts, doms)]
+    with self._measure('render'):
+      return [self._get_result(chunks, attributes) for chunks in chunk_lists]
+
+  def _get_chunks(self, input_text, language):
+    """Returns a list of chunks by using the segmenter for the language.
+
+    Args:
+      input_text: String to parse.
+      language: A language used to parse text (string, optional).
+
+    Returns:
+      A list of Chunks.
+    """
+    segmenter, text_language = self._get_segmenter(input_text, language)
+    if segmenter is None:
+      return self._get_chunks_with_api(input_text, language)
+    return self._get_chunks_with_segmenter(segmenter, input_text, text_language)
+
+  def _get_chunks_with_api(self, input_text, language):
+    """Returns a list of chunks by using Natural Language API.
+
+    Args:
+      input_text: String to parse.
+      language: A language used to parse text (string, optional).
+
+    Returns:
+      A list of Chunks.
+    """
+    with self._measure('annotate'):
+      chunks = self._get_source_chunks(input_text, language)
+    with self._measure('concatenate'):
+      return self._concatenate_chunks(chunks)
+
+  def _get_chunks_with_api_batch(self, input_texts, language,
+                                 max_bytes=MAX_BATCH_BYTES):
+    """Returns lists of chunks for the texts by packing them into requests.
+
+    Args:
+      input_texts: A list of strings to parse.
+      language: A language used to parse text (string, optional).
+      max_bytes: The maximum size of the text sent in a single request in
+      bytes (number, optional).
+
+    Returns:
+      A list of lists of Chunks in the same order as the input texts.
+    """
+    result = []
+    for pack in self._pack_texts(input_texts, max_bytes):
+      with self._measure('annotate'):
+        tokens = self._get_annotations(BATCH_SEPARATOR.join(pack), language)
+        pack_chunks = [
+            self._get_chunks_from_tokens(fragment_tokens)
+            for fragment_tokens in self._split_tokens(tokens, pack)]
+      with self._measure('concatenate'):
+        result.extend(
+            self._concatenate_chunks(chunks) for chunks in pack_chunks)
+    return result
+
+  def _pack_texts(self, input_texts, max_bytes):
+    """Groups the texts into packs whose joined size fits in the limit.
+
+    A text larger than the limit by itself makes a pack of its own.
+
+    Args:
+      input_texts: A list of strings to pack.
+      max_bytes: The maximum size of a pack in bytes (number).
+
+    Returns:
+      A list of lists of strings.
+    """
+    packs = []
+    pack = []
+    pack_size = 0
+    separator_size = len(BATCH_SEPARATOR.encode('utf8'))
+    for text in input_texts:
+      size = len(text.encode('utf8'))
+      if pack and pack_size + separator_size + size > max_bytes:
+        packs.append(pack)
+        pack = []
+        pack_size = 0
+      if pack: pack_size += separator_size
+      pack.append(text)
+      pack_size += size
+    if pack: packs.append(pack)
+    return packs
+
+  def _split_tokens(self, tokens, texts):
+    """Splits the tokens of joined texts back into tokens per text.
+
+    Offsets and head token indices are rebased so that each list of tokens
+    looks as if the text was annotated on its own.
+
+    Args:
+      tokens: The list of tokens of the texts joined by the separator.
+      texts: The list of texts that were joined (list of unicode).
+
+    Returns:
+      A list of lists of tokens in the same order as the texts.
+    """
+    result = [[] for _ in texts]
+    first_indices = [None] * len(texts)
+    starts = []
+    start = 0
+    for text in texts:
+      starts.append(start)
+      start += len(text) + len(BATCH_SEPARATOR)
+    i = 0
+    for token_index, token in enumerate(tokens):
+      begin_offset = token['text']['beginOffset']
+      while i + 1 < len(texts) and starts[i + 1] <= begin_offset:
+        i += 1
+      if first_indices[i] is None: first_indices[i] = token_index
+      new_token = dict(token)
+      new_token['text'] = dict(
+          token['text'], beginOffset=begin_offset - starts[i])
+      new_token['dependencyEdge'] = dict(
+          token['dependencyEdge'],
+          headTokenIndex=(token['dependencyEdge']['headTokenIndex'] -
+                          first_indices[i]))
+      result[i].append(new_token)
+    return result
+
+  def _get_annotations(self, text, language='', encoding='UTF32'):
+    """Returns the list of annotations from the given text."""
+    body = self._get_annotation_body(text, language, encoding)
+    request = self._get_service().documents().annotateText(body=body)
+    response = request.execute(num_retries=self.num_retries)
+    tokens = response.get('tokens', [])
+    self._count_annotation(text, tokens)
+    return tokens
+
+  def _get_service(self):
+    """Returns the service to be used by the current thread.
+
+    Returns:
+      A Resource object.
+    """
+    if (self.service_factory is None or
+        threading.current_thread() is self._thread):
+      return self.service
+    service = getattr(self._local, 'service', None)
+    if service is None:
+      service = self.service_factory()
+      self._local.service = service
+    return service
+
+  def _get_source_chunks(self, input_text, language=''):
+    """Returns the words chunks.
+
+    Args:
+      input_text: An input text to annotate (unicode).
+      language: A language used to parse text (string).
+
+    Returns:
+      A list of word chunk objects (list).
+    """
+    tokens = self._get_annotations(input_text, language)
+    return self._get_chunks_from_tokens(tokens)
@@ -14,20 +14,79 @@
 
 """Budou cache factory class."""
 from abc import ABCMeta, abstractmethod
+import collections
 import hashlib
+import os
 import six
 import shelve
+import threading
+import time
+from six.moves import cPickle as pickle
 
-CACHE_SALT = '2016-10-11'
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+CACHE_SALT = '2026-10-16.3'
 SHELVE_CACHE_FILE_NAME = 'budou-cache.shelve'
+DEFAULT_REDIS_URL = 'redis://localhost:6379/0'
+# Environment variables which configure the cache loaded by default.
+CACHE_BACKEND_ENV = 'BUDOU_CACHE'
+REDIS_URL_ENV = 'BUDOU_REDIS_URL'
+CACHE_TTL_ENV = 'BUDOU_CACHE_TTL'
+
+# Factories of caches keyed by backend name, filled by register_cache_backend.
+_backends = {}
+
+def load_cache(backend=None, **kwargs):
+  """Returns the cache of the backend selected by configuration.
+
+  The backend is given by the argument or else by the BUDOU_CACHE environment
+  variable. Without either, memcache is used on App Engine and ShelveCache
+  elsewhere. For 'redis', the URL and the TTL in seconds default to the
+  BUDOU_REDIS_URL and BUDOU_CACHE_TTL environment variables.
+
+  Args:
+    backend: 'shelve', 'persistent_shelve', 'memory', 'redis', 'appengine' or
+    the name of a registered backend (string, optional).
+    **kwargs: Arguments passed to the factory of the backend.
+
+  Returns:
+    A BudouCache object.
+  """
+  backend = backend or os.environ.get(CACHE_BACKEND_ENV)
+  if backend is None:
+    try:
+      from google.appengine.api import memcache
+    except:
+      return ShelveCache()
+    else:
+      return AppEngineCache(memcache)
+  if backend not in _backends:
+    raise ValueError('Unknown cache backend: %s' % backend)
+  return _backends[backend](**kwargs)
 
-def load_cache():
-  try:
-    from google.appengine.api import memcache
-  except:
-    return ShelveCache()
-  else:
-    return AppEngineCache(memcache)
+def register_cache_backend(name, factory):
+  """Registers a backend which load_cache can select by name.
+
+  Args:
+    name: The name of the backend (string).
+    factory: A function which returns a BudouCache given the keyword
+    arguments of load_cache, such as a subclass of BudouCache (function).
+  """
+  _backends[name] = factory
+
+def _load_redis_cache(**kwargs):
+  if 'client' not in kwargs:
+    kwargs.setdefault('url', os.environ.get(REDIS_URL_ENV, DEFAULT_REDIS_URL))
+  if os.environ.get(CACHE_TTL_ENV):
+    kwargs.setdefault('ttl', int(os.environ[CACHE_TTL_ENV]))
+  return RedisCache(**kwargs)
+
+def _load_app_engine_cache():
+  from google.appengine.api import memcache
+  return AppEngineCache(memcache)
 
 
 @six.add_metaclass(ABCMeta)
@@ -44,26 +103,354 @@ class BudouCache(object):
   def set(self, source, language, value):
     pass
 
+  def get_many(self, sources, language):
+    """Returns the values of the sources in the language.
+
+    Backends override this to fetch all the values in a single round trip.
+
+    Args:
+      sources: A list of sources (list of unicode).
+      language: A language of the sources (string).
+
+    Returns:
+      A list of the values in the same order as the sources, in which None
+      stands for a missing value.
+    """
+    return [self.get(source, language) for source in sources]
+
+  def set_many(self, values, language):
+    """Sets the values of the sources in the language.
+
+    Backends override this to store all the values in a single round trip.
+
+    Args:
+      values: A dictionary which maps sources to values.
+      language: A language of the sources (string).
+    """
+    for source, value in values.items():
+      self.set(source, language, value)
+
   def _get_cache_key(self, source, language):
-    """Returns a cache key for the given source and class name."""
-    key_source = u'%s:%s:%s' % (CACHE_SALT, source, language)
+    """Returns a cache key for the given source and language."""
+    key_source = u'%s:%s:%s' % (CACHE_SALT, source, (language or '').lower())
     return hashlib.md5(key_source.encode('utf8')).hexdigest()
 
 
 class ShelveCache(BudouCache):
 
+  # Serializes access from threads so that they do not open the file at once.
+  _lock = threading.Lock()
+
   def get(self, source, language):
-    cache_shelve = shelve.open(SHELVE_CACHE_FILE_NAME)
-    cache_key = self._get_cache_key(source, language)
-    result_value = cache_shelve.get(cache_key, None)
-    cache_shelve.close()
+    with self._lock:
+      cache_shelve = shelve.open(SHELVE_CACHE_FILE_NAME)
+      cache_key = self._get_cache_key(source, language)
+      result_value = cache_shelve.get(cache_key, None)
+      cache_shelve.close()
     return result_value
 
   def set(self, source, language, value):
-    cache_shelve = shelve.open(SHELVE_CACHE_FILE_NAME)
+    with self._lock:
+      cache_shelve = shelve.open(SHELVE_CACHE_FILE_NAME)
+      cache_key = self._get_cache_key(source, language)
+      cache_shelve[cache_key] = value
+      cache_shelve.close()
+
+  def get_many(self, sources, language):
+    with self._lock:
+      cache_shelve = shelve.open(SHELVE_CACHE_FILE_NAME)
+      result_values = [
+          cache_shelve.get(self._get_cache_key(source, language), None)
+          for source in sources]
+      cache_shelve.close()
+    return result_values
+
+  def set_many(self, values, language):
+    with self._lock:
+      cache_shelve = shelve.open(SHELVE_CACHE_FILE_NAME)
+      for source, value in values.items():
+        cache_shelve[self._get_cache_key(source, language)] = value
+      cache_shelve.close()
+
+
+class PersistentShelveCache(BudouCache):
+  """A shelve cache which keeps the shelve file open across calls.
+
+  Every access is guarded by a lock on a companion lock file so that several
+  processes can share the same cache file. Reads take a shared lock and writes
+  take an exclusive one. The lock file also holds a counter
+  of writes, which lets each process reopen the shelve file only when another
+  process has written to it. File locking is not available on platforms
+  without fcntl, where the cache is safe only within a process.
+
+  Attributes:
+    filename: The path to the shelve file (string).
+  """
+
+  def __init__(self, filename=SHELVE_CACHE_FILE_NAME):
+    self.filename = filename
+    self._lock = threading.RLock()
+    self._shelve = None
+    self._lock_fd = None
+    self._generation = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def get(self, source, language):
     cache_key = self._get_cache_key(source, language)
-    cache_shelve[cache_key] = value
-    cache_shelve.close()
+    with self._lock:
+      self._acquire_file_lock(shared=True)
+      try:
+        return self._get_shelve().get(cache_key, None)
+      finally:
+        self._release_file_lock()
+
+  def set(self, source, language, value):
+    self.set_many({source: value}, language)
+
+  def get_many(self, sources, language):
+    cache_keys = [self._get_cache_key(source, language) for source in sources]
+    with self._lock:
+      self._acquire_file_lock(shared=True)
+      try:
+        cache_shelve = self._get_shelve()
+        return [cache_shelve.get(cache_key, None) for cache_key in cache_keys]
+      finally:
+        self._release_file_lock()
+
+  def set_many(self, values, language):
+    items = [(self._get_cache_key(source, language), value)
+             for source, value in values.items()]
+    if not items:
+      return
+    with self._lock:
+      self._acquire_file_lock()
+      try:
+        cache_shelve = self._get_shelve()
+        for cache_key, value in items:
+          cache_shelve[cache_key] = value
+        cache_shelve.sync()
+        self._write_generation(self._generation + 1)
+      finally:
+        self._release_file_lock()
+
+  def close(self):
+    """Closes the shelve file and the lock file."""
+    with self._lock:
+      if self._shelve is not None:
+        self._close_shelve()
+      if self._lock_fd is not None:
+        os.close(self._lock_fd)
+        self._lock_fd = None
+      self._generation = None
+
+  def _get_shelve(self):
+    """Returns the open shelve, reopening it if another process wrote to it.
+
+    This must be called while holding the file lock, which may be shared.
+    Reopening the shelve only reads the file, except that it creates an empty
+    one if the file does not exist yet.
+
+    Returns:
+      A shelve object.
+    """
+    generation = self._read_generation()
+    if self._shelve is not None and generation != self._generation:
+      self._close_shelve()
+    if self._shelve is None:
+      try:
+        # Opens GNU dbm without its own exclusive lock, which would otherwise
+        # prevent other processes from opening the file.
+        self._shelve = shelve.open(self.filename, flag='cu')
+      except Exception:
+        self._shelve = shelve.open(self.filename)
+    self._generation = generation
+    return self._shelve
+
+  def _close_shelve(self):
+    """Closes the shelve without writing back its index.
+
+    Every write is synced immediately, so there is nothing left to write on
+    close. dbm.dumb (dumbdbm on Python 2) however writes its whole in-memory
+    index back to the .dir file on close, which would drop entries written by
+    other processes since it was opened.
+
+    This depends on the private `_index` attribute of the dbm.dumb database,
+    whose `close` skips writing the index when `_index` is None. It holds for
+    CPython 2.7 and 3.x. Other dbm modules have no `_index` and are closed
+    normally.
+    """
+    database = getattr(self._shelve, 'dict', None)
+    if hasattr(database, '_index'):
+      database._index = None
+    self._shelve.close()
+    self._shelve = None
+
+  def _acquire_file_lock(self, shared=False):
+    if self._lock_fd is None:
+      self._lock_fd = os.open(
+          self.filename + '.lock', os.O_RDWR | os.O_CREAT, 0o666)
+    if fcntl:
+      fcntl.flock(self._lock_fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+  def _release_file_lock(self):
+    if fcntl:
+      fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+  def _read_generation(self):
+    os.lseek(self._lock_fd, 0, os.SEEK_SET)
+    content = os.read(self._lock_fd, 32)
+    return int(content) if content else 0
+
+  def _write_generation(self, generation):
+    content = str(generation).encode('ascii')
+    os.lseek(self._lock_fd, 0, os.SEEK_SET)
+    os.write(self._lock_fd, content)
+    os.ftruncate(self._lock_fd, len(content))
+    self._generation = generation
+
+
+class MemoryLRUCache(BudouCache):
+  """An in-process cache which evicts the least recently used entries.
+
+  Attributes:
+    max_entries: The maximum number of entries, or None for no limit (number).
+    max_bytes: The maximum total size of pickled values in bytes, or None for
+      no limit (number).
+    ttl: The number of seconds an entry stays valid, or None to keep entries
+      until they are evicted (number).
+  """
+
+  def __init__(self, max_entries=1000, max_bytes=None, ttl=None):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self._lock = threading.Lock()
+    self._entries = collections.OrderedDict()
+    self._total_bytes = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, source, language):
+    return self.get_many([source], language)[0]
+
+  def set(self, source, language, value):
+    self.set_many({source: value}, language)
+
+  def get_many(self, sources, language):
+    language = (language or '').lower()
+    now = time.time()
+    with self._lock:
+      return [self._get_entry((source, language), now) for source in sources]
+
+  def set_many(self, values, language):
+    language = (language or '').lower()
+    expires = time.time() + self.ttl if self.ttl is not None else None
+    entries = [
+        ((source, language), value,
+         len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+         if self.max_bytes is not None else 0)
+        for source, value in values.items()]
+    with self._lock:
+      for cache_key, value, size in entries:
+        self._set_entry(cache_key, value, size, expires)
+
+  def _get_entry(self, cache_key, now):
+    """Returns the value of the key and marks it as recently used.
+
+    This must be called while holding the lock.
+    """
+    entry = self._entries.pop(cache_key, None)
+    if entry is None:
+      return None
+    value, size, expires = entry
+    if expires is not None and expires <= now:
+      self._total_bytes -= size
+      return None
+    self._entries[cache_key] = entry
+    return value
+
+  def _set_entry(self, cache_key, value, size, expires):
+    """Sets the value of the key and evicts entries over the limits.
+
+    This must be called while holding the lock.
+    """
+    entry = self._entries.pop(cache_key, None)
+    if entry is not None:
+      self._total_bytes -= entry[1]
+    if self.max_bytes is not None and size > self.max_bytes:
+      return
+    self._entries[cache_key] = (value, size, expires)
+    self._total_bytes += size
+    while ((self.max_entries is not None and
+            len(self._entries) > self.max_entries) or
+           (self.max_bytes is not None and
+            self._total_bytes > self.max_bytes)):
+      _, (_, evicted_size, _) = self._entries.popitem(last=False)
+      self._total_bytes -= evicted_size
+
+  def clear(self):
+    """Removes all entries."""
+    with self._lock:
+      self._entries.clear()
+      self._total_bytes = 0
+
+
+class TieredCache(BudouCache):
+  """A two-level cache which puts a fast cache in front of a slower one.
+
+  Values are read from the first level and, on a miss, from the second level,
+  which then fills the first level. Values are written to both levels.
+
+  Attributes:
+    l1: The first level cache, typically a MemoryLRUCache (BudouCache).
+    l2: The second level cache, typically a ShelveCache or an AppEngineCache
+      (BudouCache).
+  """
+
+  def __init__(self, l1, l2):
+    self.l1 = l1
+    self.l2 = l2
+
+  def __repr__(self):
+    return '<%s %r %r>' % (self.__class__.__name__, self.l1, self.l2)
+
+  def get(self, source, language):
+    result_value = self.l1.get(source, language)
+    if result_value is not None:
+      return result_value
+    result_value = self.l2.get(source, language)
+    if result_value is not None:
+      self.l1.set(source, language, result_value)
+    return result_value
+
+  def set(self, source, language, value):
+    self.l1.set(source, language, value)
+    self.l2.set(source, language, value)
+
+  def get_many(self, sources, language):
+    result_values = self.l1.get_many(sources, language)
+    missing = [i for i, value in enumerate(result_values) if value is None]
+    if not missing:
+      return result_values
+    l2_values = self.l2.get_many([sources[i] for i in missing], language)
+    found = {}
+    for i, value in zip(missing, l2_values):
+      result_values[i] = value
+      if value is not None:
+        found[sources[i]] = value
+    if found:
+      self.l1.set_many(found, language)
+    return result_values
+
+  def set_many(self, values, language):
+    self.l1.set_many(values, language)
+    self.l2.set_many(values, language)
 
 
 class AppEngineCache(BudouCache):
@@ -79,3 +466,93 @@ class AppEngineCache(BudouCache):
   def set(self, source, language, value):
     cache_key = self._get_cache_key(source, language)
     self.memcache.set(cache_key, value)
+
+  def get_many(self, sources, language):
+    cache_keys = [self._get_cache_key(source, language) for source in sources]
+    result_values = self.memcache.get_multi(cache_keys)
+    return [result_values.get(cache_key) for cache_key in cache_keys]
+
+  def set_many(self, values, language):
+    self.memcache.set_multi(dict(
+        (self._get_cache_key(source, language), value)
+        for source, value in values.items()))
+
+
+class RedisCache(BudouCache):
+  """A cache on Redis, which can be shared by many hosts.
+
+  Keys are namespaced with CACHE_SALT, so a new salt leaves old entries to
+  expire on their own. Multiple values are read with a single MGET and written
+  with a single pipeline, so a batch costs one round trip each way.
+
+  Values must be bytes, such as the chunks encoded by parsers, and are stored
+  as they are. Nothing read from the server is unpickled, so whoever can write
+  to a shared server can not run code on the hosts reading from it.
+
+  Attributes:
+    client: A redis.Redis client, or another client with the same interface.
+    ttl: The number of seconds an entry stays valid, or None to keep entries
+      until Redis evicts them (number).
+    namespace: The prefix of keys (string).
+  """
+
+  def __init__(self, client=None, url=DEFAULT_REDIS_URL, ttl=None,
+               namespace=None, max_connections=None):
+    """Initializes the cache.
+
+    Args:
+      client: A client to use, which is created from the URL if not given.
+      url: The URL of the Redis server (string, optional).
+      ttl: The number of seconds an entry stays valid (number, optional).
+      namespace: The prefix of keys, which defaults to one with CACHE_SALT
+      (string, optional).
+      max_connections: The maximum number of connections in the pool of the
+      client created from the URL (number, optional).
+    """
+    if client is None:
+      import redis
+      client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+          url, max_connections=max_connections))
+    self.client = client
+    self.ttl = ttl
+    self.namespace = namespace or 'budou:%s:' % CACHE_SALT
+
+  def get(self, source, language):
+    return self.client.get(self._get_redis_key(source, language))
+
+  def set(self, source, language, value):
+    self.client.set(
+        self._get_redis_key(source, language), self._dump(value), ex=self.ttl)
+
+  def get_many(self, sources, language):
+    if not sources:
+      return []
+    result_values = self.client.mget(
+        [self._get_redis_key(source, language) for source in sources])
+    return list(result_values)
+
+  def set_many(self, values, language):
+    if not values:
+      return
+    pipeline = self.client.pipeline(transaction=False)
+    for source, value in values.items():
+      pipeline.set(
+          self._get_redis_key(source, language), self._dump(value),
+          ex=self.ttl)
+    pipeline.execute()
+
+  def _get_redis_key(self, source, language):
+    return self.namespace + self._get_cache_key(source, language)
+
+  def _dump(self, value):
+    if not isinstance(value, bytes):
+      raise TypeError('RedisCache stores only bytes, not %s.' % (
+          type(value).__name__))
+    return value
+
+
+register_cache_backend('shelve', ShelveCache)
+register_cache_backend('persistent_shelve', PersistentShelveCache)
+register_cache_backend('memory', MemoryLRUCache)
+register_cache_backend('redis', _load_redis_cache)
+register_cache_backend('appengine', _load_app_engine_cache)
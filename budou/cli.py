@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command line interface to process HTML fragments in bulk.
+
+Fragments are read from files or stdin, one per line, one per JSON object or
+one per file, and parsed in a pool of processes which share a persistent
+cache. Results are written as JSON lines in the order of the input.
+
+Example invocation:
+
+    $ budou --language ja --credentials key.json catalogue.txt > out.jsonl
+    $ cat catalogue.jsonl | budou --format jsonl --offline -o out.jsonl
+"""
+
+from __future__ import print_function
+from . import budou
+from .cachefactory import PersistentShelveCache
+from .segmenter import JapaneseSegmenter
+import argparse
+import io
+import itertools
+import json
+import multiprocessing
+import six
+import sys
+import time
+
+INPUT_FORMATS = ('lines', 'jsonl', 'file')
+DEFAULT_BATCH_SIZE = 100
+PROGRESS_INTERVAL = 1.0
+# Kept apart from the file of ShelveCache, which parsers use by default.
+CACHE_FILE_NAME = 'budou-cli-cache.shelve'
+
+# The parser and options of a worker process, set by _init_worker.
+_parser = None
+_options = None
+
+
+def main(argv=None):
+  """Runs the command line interface.
+
+  Args:
+    argv: Command line arguments without the program name (list, optional).
+
+  Returns:
+    The exit status (number).
+  """
+  options = get_argument_parser().parse_args(argv)
+  if options.output == '-':
+    output = io.open(sys.stdout.fileno(), 'w', encoding='utf8', closefd=False)
+  else:
+    output = io.open(options.output, 'w', encoding='utf8')
+  batches = _get_batches(_read_items(options), options.batch_size)
+  count = 0
+  start = last_report = time.time()
+  with output:
+    for lines in _process(batches, options):
+      for line in lines:
+        output.write(line + u'\n')
+      count += len(lines)
+      now = time.time()
+      if not options.quiet and now - last_report >= PROGRESS_INTERVAL:
+        _report(count, now - start, end=u'\r')
+        last_report = now
+  if not options.quiet:
+    _report(count, time.time() - start, end=u'\n')
+  return 0
+
+
+def get_argument_parser():
+  """Returns the parser of command line arguments.
+
+  Returns:
+    An argparse.ArgumentParser object.
+  """
+  parser = argparse.ArgumentParser(
+      prog='budou', description='Organizes line breaks of CJK HTML fragments.')
+  parser.add_argument(
+      'files', nargs='*', default=['-'], metavar='FILE',
+      help='input files, or - for stdin (default: stdin)')
+  parser.add_argument(
+      '--format', choices=INPUT_FORMATS, default='lines',
+      help='a fragment per line, a JSON object per line or a fragment per '
+      'file (default: lines)')
+  parser.add_argument(
+      '--key', default='source',
+      help='the key of fragments in JSON objects (default: source)')
+  parser.add_argument(
+      '-o', '--output', default='-',
+      help='a file to write JSON lines to (default: stdout)')
+  parser.add_argument('--language', default='', help='language of the text')
+  parser.add_argument(
+      '--classname', default=budou.DEFAULT_CLASS_NAME,
+      help='class name of the SPAN tags (default: %(default)s)')
+  parser.add_argument(
+      '--credentials', metavar='PATH',
+      help='a credential JSON file for Natural Language API')
+  parser.add_argument(
+      '--offline', action='store_true',
+      help='segment Japanese text by rules instead of Natural Language API')
+  parser.add_argument(
+      '--cache', default=CACHE_FILE_NAME, metavar='PATH',
+      help='a cache file shared by the processes (default: %(default)s)')
+  parser.add_argument(
+      '--no-cache', dest='use_cache', action='store_false',
+      help='disable the cache')
+  parser.add_argument(
+      '-p', '--processes', type=int, default=multiprocessing.cpu_count(),
+      help='the number of processes (default: the number of CPUs)')
+  parser.add_argument(
+      '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+      help='the number of fragments per task and API request pack '
+      '(default: %(default)s)')
+  parser.add_argument(
+      '-q', '--quiet', action='store_true', help='do not report progress')
+  return parser
+
+
+def _read_items(options):
+  """Yields the input items.
+
+  Args:
+    options: Parsed command line arguments.
+
+  Yields:
+    Tuples of the HTML fragment and the dictionary the output is built upon.
+  """
+  for path in options.files:
+    if path == '-':
+      stream = io.open(sys.stdin.fileno(), encoding='utf8', closefd=False)
+    else:
+      stream = io.open(path, encoding='utf8')
+    with stream:
+      if options.format == 'file':
+        yield stream.read(), {'file': path}
+        continue
+      for line in stream:
+        line = line.rstrip(u'\r\n')
+        if not line.strip():
+          continue
+        if options.format == 'jsonl':
+          record = json.loads(line)
+          yield record[options.key], record
+        else:
+          yield line, {'source': line}
+
+
+def _get_batches(items, batch_size):
+  """Groups items into lists of the batch size.
+
+  Args:
+    items: An iterable of items.
+    batch_size: The maximum number of items in a list (number).
+
+  Yields:
+    Lists of items.
+  """
+  items = iter(items)
+  while True:
+    batch = list(itertools.islice(items, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+def _process(batches, options):
+  """Processes the batches in a pool of processes, or in this process.
+
+  Args:
+    batches: An iterable of lists of input items.
+    options: Parsed command line arguments.
+
+  Yields:
+    Lists of output JSON lines in the order of the batches.
+  """
+  if options.processes <= 1:
+    _init_worker(options)
+    try:
+      for batch in batches:
+        yield _process_batch(batch)
+    finally:
+      _close_worker()
+    return
+  pool = multiprocessing.Pool(
+      options.processes, initializer=_init_worker, initargs=(options,))
+  try:
+    for lines in pool.imap(_process_batch, batches):
+      yield lines
+  except BaseException:
+    pool.terminate()
+    raise
+  else:
+    pool.close()
+  finally:
+    pool.join()
+
+
+def _init_worker(options):
+  """Sets up the parser and the cache of a worker process.
+
+  Args:
+    options: Parsed command line arguments.
+  """
+  global _parser, _options
+  _options = options
+  cache = PersistentShelveCache(options.cache) if options.use_cache else None
+  if options.offline:
+    _parser = budou.Budou(None, segmenter=JapaneseSegmenter(), cache=cache)
+  elif options.language.lower() == 'ko':
+    _parser = budou.Budou(None, cache=cache)
+  else:
+    _parser = budou.Budou.authenticate(options.credentials, cache=cache)
+
+
+def _close_worker():
+  """Closes the cache of the worker in this process and drops the parser."""
+  global _parser
+  if _parser.cache is not None:
+    _parser.cache.close()
+  _parser = None
+
+
+def _process_batch(batch):
+  """Parses a batch of items.
+
+  Args:
+    batch: A list of input items.
+
+  Returns:
+    A list of output JSON lines (list of unicode).
+  """
+  results = _parser.parse_batch(
+      [source for source, _ in batch], use_cache=_options.use_cache,
+      language=_options.language, classname=_options.classname)
+  lines = []
+  for (_, record), result in zip(batch, results):
+    record = dict(record)
+    record['html_code'] = result['html_code']
+    record['chunks'] = [chunk._asdict() for chunk in result['chunks']]
+    lines.append(six.text_type(json.dumps(record, ensure_ascii=False)))
+  return lines
+
+
+def _report(count, seconds, end):
+  """Writes the progress to stderr.
+
+  Args:
+    count: The number of processed fragments (number).
+    seconds: The elapsed time in seconds (number).
+    end: The string written at the end (unicode).
+  """
+  rate = count / seconds if seconds > 0 else 0.0
+  sys.stderr.write(u'%d fragments in %.1fs (%.1f fragments/s)%s' % (
+      count, seconds, rate, end))
+  sys.stderr.flush()
+
+
+if __name__ == '__main__':
+  sys.exit(main())
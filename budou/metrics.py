@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Collectors of the metrics of Budou parsers.
+
+A parser given a collector reports these metrics:
+
+  Timings in seconds of the stages: preprocess, dom, segment, annotate,
+  concatenate, migrate_html and render, and of parse as a whole.
+  Counters: cache.hit and cache.miss tagged with the cache backend,
+  api.requests, api.bytes and api.tokens.
+"""
+
+import timeit
+
+
+class MetricsCollector(object):
+  """Base class of collectors, which discards all metrics."""
+
+  def __repr__(self):
+    return '<%s>' % (self.__class__.__name__)
+
+  def timing(self, name, seconds, tags=None):
+    """Records the time taken by a stage.
+
+    Args:
+      name: The name of the metric (string).
+      seconds: The elapsed time in seconds (number).
+      tags: Tags of the metric (dictionary, optional).
+    """
+    pass
+
+  def increment(self, name, value=1, tags=None):
+    """Increments a counter.
+
+    Args:
+      name: The name of the metric (string).
+      value: The amount to add to the counter (number, optional).
+      tags: Tags of the metric (dictionary, optional).
+    """
+    pass
+
+
+class CallbackCollector(MetricsCollector):
+  """A collector which passes every metric to a function.
+
+  Attributes:
+    callback: A function called with the kind of metric ('timing' or
+      'increment'), the name, the value and the tags (function).
+  """
+
+  def __init__(self, callback):
+    self.callback = callback
+
+  def timing(self, name, seconds, tags=None):
+    self.callback('timing', name, seconds, tags)
+
+  def increment(self, name, value=1, tags=None):
+    self.callback('increment', name, value, tags)
+
+
+class StatsdCollector(MetricsCollector):
+  """A collector which sends metrics to a StatsD server over UDP.
+
+  Tags are written in the DogStatsD format, which statsd_exporter translates
+  into Prometheus labels. Sending is best effort, so a missing server never
+  fails a parse.
+
+  Attributes:
+    address: A tuple of the host and the port of the server.
+    prefix: The prefix of metric names (string).
+  """
+
+  def __init__(self, host='localhost', port=8125, prefix='budou'):
+    import socket
+    self.address = (host, port)
+    self.prefix = prefix
+    self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+  def timing(self, name, seconds, tags=None):
+    self._send(name, '%.3f' % (seconds * 1000), 'ms', tags)
+
+  def increment(self, name, value=1, tags=None):
+    self._send(name, '%d' % value, 'c', tags)
+
+  def close(self):
+    """Closes the socket."""
+    self._socket.close()
+
+  def _send(self, name, value, metric_type, tags):
+    """Sends a metric to the server.
+
+    Args:
+      name: The name of the metric (string).
+      value: The formatted value (string).
+      metric_type: The StatsD type of the metric (string).
+      tags: Tags of the metric (dictionary).
+    """
+    packet = '%s.%s:%s|%s' % (self.prefix, name, value, metric_type)
+    if tags:
+      packet += '|#' + ','.join(
+          '%s:%s' % (key, tags[key]) for key in sorted(tags))
+    try:
+      self._socket.sendto(packet.encode('utf8'), self.address)
+    except (IOError, OSError):
+      pass
+
+
+class Timer(object):
+  """A context manager which reports the time taken by its block.
+
+  The time is measured by a monotonic clock where available, so adjustments
+  of the system clock do not skew it.
+
+  Attributes:
+    collector: The MetricsCollector to report to.
+    name: The name of the metric (string).
+  """
+
+  def __init__(self, collector, name):
+    self.collector = collector
+    self.name = name
+    self._start = None
+
+  def __enter__(self):
+    self._start = timeit.default_timer()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.collector.timing(self.name, timeit.default_timer() - self._start)
+
+
+class NullTimer(object):
+  """A context manager which does nothing, used when metrics are disabled."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    pass
+
+
+NULL_TIMER = NullTimer()
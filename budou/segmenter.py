@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Budou segmenters which split text into word chunks without the API."""
+from abc import ABCMeta, abstractmethod
+from .budou import Chunk
+from .budou import SPACE_POS
+import re
+import six
+
+HIRAGANA = u'ぁ-ゟ'
+KATAKANA = u'゠-ヿㇰ-ㇿｦ-ﾟ'
+KANJI = u'㐀-䶿一-鿿豈-﫿々〆'
+OPENING_PUNCTUATIONS = u'「『（(［[｛{〈《【〔“‘'
+CLOSING_PUNCTUATIONS = u'」』）)］\\]｝}〉》】〕”’'
+PUNCTUATIONS = u'、。，．,.！？!?・：；:;…‥'
+JAPANESE_TOKEN_RE = re.compile(
+    u'(?P<space>\\s+)|(?P<hiragana>[%s]+)|(?P<katakana>[%s]+)|'
+    u'(?P<kanji>[%s]+)|(?P<opening>[%s]+)|(?P<closing>[%s]+)|'
+    u'(?P<punctuation>[%s]+)|'
+    u'(?P<digit>[0-9０-９]+)|(?P<alphanumeric>[0-9A-Za-z０-９Ａ-Ｚａ-ｚ]+)|'
+    u'(?P<other>.)' % (
+        HIRAGANA, KATAKANA, KANJI, OPENING_PUNCTUATIONS, CLOSING_PUNCTUATIONS,
+        PUNCTUATIONS),
+    re.S)
+HANGUL = u'ᄀ-ᇿ㄰-㆏가-힯'
+HANGUL_RE = re.compile(u'[%s]' % HANGUL)
+KANA_RE = re.compile(u'[%s%s]' % (HIRAGANA, KATAKANA))
+PREFIXES = (u'お', u'ご')
+# Kinds of tokens which hiragana following them is attached to.
+CONTENT_KINDS = (
+    'kanji', 'katakana', 'digit', 'alphanumeric', 'closing', 'other')
+
+
+@six.add_metaclass(ABCMeta)
+class Segmenter(object):
+  """Base class of segmenters.
+
+  A segmenter splits text into source word chunks. The part of speech, label
+  and direction of each chunk are then used by Budou to concatenate the chunks
+  just as it does for the result of Natural Language API.
+  """
+
+  def __repr__(self):
+    return '<%s>' % (self.__class__.__name__)
+
+  @abstractmethod
+  def segment(self, input_text, language):
+    """Returns the source word chunks of the text.
+
+    Args:
+      input_text: String to segment (unicode).
+      language: A language of the text (string).
+
+    Returns:
+      A list of Chunks.
+    """
+    pass
+
+
+class JapaneseSegmenter(Segmenter):
+  """A rule-based segmenter for Japanese which works offline.
+
+  Text is split into runs of the same character class. Runs of kanji,
+  katakana, digits and other letters make words, and runs of hiragana
+  following them or closing brackets are attached to them as particles and
+  inflections. Opening brackets and the honorific prefixes before kanji, even
+  at the end of a run of hiragana, are attached to the following words, and
+  punctuation marks and closing brackets to the preceding ones.
+  """
+
+  def segment(self, input_text, language='ja'):
+    chunks = []
+    previous = None
+    matches = list(JAPANESE_TOKEN_RE.finditer(input_text))
+    for i, match in enumerate(matches):
+      kind = match.lastgroup
+      word = match.group()
+      following = matches[i + 1].lastgroup if i + 1 < len(matches) else None
+      if kind == 'space':
+        chunks.append(Chunk(word, SPACE_POS, SPACE_POS, True))
+      elif kind == 'hiragana':
+        prefix = None
+        if following == 'kanji' and len(word) > 1 and word[-1] in PREFIXES:
+          # A prefix at the end of a run, as in "はお寿司", goes to the noun.
+          word, prefix = word[:-1], word[-1]
+        if previous in CONTENT_KINDS:
+          chunks.append(Chunk(word, u'PRT', u'PRT', False))
+        elif word in PREFIXES and following == 'kanji':
+          chunks.append(Chunk(word, u'AFFIX', u'PRT', True))
+        else:
+          chunks.append(Chunk(word, u'NOUN', u'NN', False))
+        if prefix is not None:
+          chunks.append(Chunk(prefix, u'AFFIX', u'PRT', True))
+      elif kind == 'opening':
+        chunks.append(Chunk(word, u'AFFIX', u'P', True))
+      elif kind in ('closing', 'punctuation'):
+        chunks.append(Chunk(word, u'PUNCT', u'P', False))
+      elif kind == 'kanji' and previous == 'digit' and len(word) == 1:
+        chunks.append(Chunk(word, u'NOUN', u'SUFF', False))
+      elif kind == 'digit':
+        chunks.append(Chunk(word, u'NUM', u'NUM', False))
+      else:
+        chunks.append(Chunk(word, u'NOUN', u'NN', False))
+      previous = kind
+    return chunks
+
+
+class SpaceSegmenter(Segmenter):
+  """A segmenter which separates words by spaces.
+
+  This suits languages which put spaces between words, such as Korean.
+  """
+
+  def segment(self, input_text, language=''):
+    chunks = []
+    for word in input_text.split():
+      chunks.append(Chunk(word, None, None, True))
+      chunks.append(Chunk(u' ', SPACE_POS, SPACE_POS, True))
+    return chunks[:-1]
+
+
+def detect_language(input_text):
+  """Guesses the language of the text from the scripts used in it.
+
+  The script with more characters wins, so Japanese text quoting a few Hangul
+  characters is still Japanese and vice versa. Text written only in kanji is
+  not detected since it can be either Japanese or Chinese.
+
+  Args:
+    input_text: String to detect the language of (unicode).
+
+  Returns:
+    A language code, or an empty string if the language is unknown (string).
+  """
+  hangul_count = len(HANGUL_RE.findall(input_text))
+  kana_count = len(KANA_RE.findall(input_text))
+  if hangul_count > kana_count:
+    return 'ko'
+  if kana_count:
+    return 'ja'
+  return ''
+
+
+# Segmenters used by default, keyed by language.
+DEFAULT_SEGMENTERS = {
+    'ko': SpaceSegmenter(),
+}
@@ -28,10 +28,16 @@ setup(
         'oauth2client',
         'lxml>=3.6.1',
         'six',
+        'futures; python_version < "3"',
     ],
-    scripts=[
-        'budou/budou.py',
-    ],
+    extras_require={
+        'async': ['aiohttp'],
+        'cssselect': ['cssselect'],
+        'redis': ['redis'],
+    },
+    entry_points={
+        'console_scripts': ['budou = budou.cli:main'],
+    },
     tests_require=[
         'mock',
     ],
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from .budou_test import DEFAULT_SENTENCE_JA
+from .budou_test import DEFAULT_TOKENS
+import budou
+import json
+import threading
+import unittest
+
+try:
+  import aiohttp
+  import asyncio
+except ImportError:
+  aiohttp = None
+
+
+class FakeAPIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Handles annotateText requests with the default tokens."""
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    length = int(self.headers['Content-Length'])
+    body = json.loads(self.rfile.read(length).decode('utf8'))
+    self.server.requests.append((self.client_address, body))
+    content = json.dumps({'tokens': DEFAULT_TOKENS}).encode('utf8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, *args):
+    pass
+
+
+class FakeAPIServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Serves each connection in its own thread, as the API does."""
+
+  daemon_threads = True
+
+
+@unittest.skipUnless(
+    aiohttp and hasattr(budou, 'AsyncBudou'), 'aiohttp is not available.')
+class TestAsyncBudouMethods(unittest.TestCase):
+
+  def setUp(self):
+    self.server = FakeAPIServer(('127.0.0.1', 0), FakeAPIHandler)
+    self.server.requests = []
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.parser = budou.AsyncBudou(
+        api_url='http://127.0.0.1:%d/' % self.server.server_address[1])
+    self.loop = asyncio.new_event_loop()
+
+  def tearDown(self):
+    self.loop.run_until_complete(self.parser.close())
+    self.loop.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_parse(self):
+    expected = budou.Budou(None)
+    expected._get_annotations = lambda *args: DEFAULT_TOKENS
+    result = self.loop.run_until_complete(self.parser.parse(
+        u'<a>今日は</a>晴れ。', language='ja', use_cache=False))
+    self.assertEqual(
+        expected.parse(u'<a>今日は</a>晴れ。', language='ja', use_cache=False),
+        result,
+        'AsyncBudou should return the same result as Budou.')
+    self.assertEqual(
+        DEFAULT_SENTENCE_JA, self.server.requests[0][1]['document']['content'],
+        'The text of the source should be sent to the API.')
+
+  def test_keep_alive(self):
+    for _ in range(3):
+      self.loop.run_until_complete(self.parser.parse(
+          DEFAULT_SENTENCE_JA, language='ja', use_cache=False))
+    clients = set(client for client, _ in self.server.requests)
+    self.assertEqual(
+        1, len(clients),
+        'Requests should reuse the same connection.')
+
+  def test_parse_many(self):
+    sources = [u'<a>今日は</a>晴れ。', DEFAULT_SENTENCE_JA, u'今日は<b>晴れ。</b>']
+    result = self.loop.run_until_complete(self.parser.parse_many(
+        sources, language='ja', use_cache=False, max_workers=2))
+    expected = [
+        self.loop.run_until_complete(self.parser.parse(
+            source, language='ja', use_cache=False)) for source in sources]
+    self.assertEqual(expected, result,
+        'The results should be in the same order as the sources.')
+
+  def test_synchronous_methods(self):
+    self.assertIsInstance(self.parser, budou.BudouBase)
+    self.assertNotIsInstance(self.parser, budou.Budou)
+    for name in ('parse_batch', 'parse_stream', 'parse_document'):
+      self.assertFalse(hasattr(self.parser, name), name)
+
+
+if __name__ == '__main__':
+  unittest.main()
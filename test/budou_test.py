@@ -16,13 +16,40 @@
 
 from lxml import html
 from mock import MagicMock
+from mock import patch
 import budou
+import copy
+import io
+import json
+import pickle
+import random
+import subprocess
+import sys
+import threading
 import os
+import shutil
+import tempfile
 import unittest
 
 DEFAULT_SENTENCE_JA = u'今日は晴れ。'
 DEFAULT_SENTENCE_KO = u'오늘은 맑음.'
 
+DISCOVERY_DOCUMENT = json.dumps({
+    'rootUrl': 'https://language.googleapis.com/',
+    'servicePath': '',
+    'name': 'language',
+    'version': 'v1beta1',
+    'resources': {'documents': {'methods': {'annotateText': {
+        'id': 'language.documents.annotateText',
+        'path': 'v1beta1/documents:annotateText',
+        'httpMethod': 'POST',
+        'request': {'$ref': 'AnnotateTextRequest'},
+    }}}},
+    'schemas': {
+        'AnnotateTextRequest': {'id': 'AnnotateTextRequest', 'type': 'object'},
+    },
+})
+
 DEFAULT_TOKENS = [
     {
         u'text': {u'content': u'今日', u'beginOffset': 0},
@@ -50,6 +77,18 @@ DEFAULT_TOKENS = [
     }]
 
 
+def get_batch_tokens(count):
+  """Returns the tokens of DEFAULT_SENTENCE_JA repeated by the separator."""
+  tokens = []
+  for i in range(count):
+    for token in copy.deepcopy(DEFAULT_TOKENS):
+      token['text']['beginOffset'] += i * (
+          len(DEFAULT_SENTENCE_JA) + len(budou.BATCH_SEPARATOR))
+      token['dependencyEdge']['headTokenIndex'] += i * len(DEFAULT_TOKENS)
+      tokens.append(token)
+  return tokens
+
+
 class TestBudouMethods(unittest.TestCase):
 
   def setUp(self):
@@ -126,6 +165,279 @@ class TestBudouMethods(unittest.TestCase):
         expected_html_code, result['html_code'],
         'Processed result should include expected html code.')
 
+  def test_parse_batch(self):
+    expected_chunks = [
+        budou.Chunk(u'今日は', u'NOUN', u'NN', True),
+        budou.Chunk(u'晴れ。', u'NOUN', u'ROOT', False)
+    ]
+    expected_html_code = (u'<span class="ww"><a>今日は</a></span>'
+                          u'<span class="ww">晴れ。</span>')
+
+    results = self.parser.parse_batch(
+        [DEFAULT_SENTENCE_JA, u'<a>今日は</a>晴れ。'], language='ja',
+        use_cache=False)
+
+    self.parser._get_annotations.assert_called_once_with(
+        DEFAULT_SENTENCE_JA, 'ja')
+    self.assertEqual(
+        expected_chunks, results[0]['chunks'],
+        'Each result should include the chunks of its own fragment.')
+    self.assertEqual(
+        expected_html_code, results[1]['html_code'],
+        'Each result should include the html code of its own fragment.')
+
+  def test_get_chunks_with_api_batch(self):
+    expected_chunks = [
+        budou.Chunk(u'今日は', u'NOUN', u'NN', True),
+        budou.Chunk(u'晴れ。', u'NOUN', u'ROOT', False)
+    ]
+    self.parser._get_annotations = MagicMock(
+        return_value=get_batch_tokens(2))
+
+    result = self.parser._get_chunks_with_api_batch(
+        [DEFAULT_SENTENCE_JA] * 2, 'ja')
+
+    self.parser._get_annotations.assert_called_once_with(
+        budou.BATCH_SEPARATOR.join([DEFAULT_SENTENCE_JA] * 2), 'ja')
+    self.assertEqual(
+        [expected_chunks, expected_chunks], result,
+        'Tokens of the joined texts should be split back per text.')
+
+  def test_get_chunks_with_api_batch_max_bytes(self):
+    max_bytes = len(DEFAULT_SENTENCE_JA.encode('utf8'))
+    result = self.parser._get_chunks_with_api_batch(
+        [DEFAULT_SENTENCE_JA] * 2, '', max_bytes=max_bytes)
+    self.assertEqual(
+        2, self.parser._get_annotations.call_count,
+        'Texts should be split into requests within the size limit.')
+    self.assertEqual(
+        result[0], result[1],
+        'Texts in different requests should be processed the same way.')
+
+  def test_parse_batch_cache(self):
+    self.parser.parse(DEFAULT_SENTENCE_JA, use_cache=True)
+    self.parser._get_annotations.reset_mock()
+    results = self.parser.parse_batch([DEFAULT_SENTENCE_JA], use_cache=True)
+    self.assertFalse(
+        self.parser._get_annotations.called,
+        'Cached fragments should not be sent to the API.')
+    self.assertEqual(
+        self.parser.parse(DEFAULT_SENTENCE_JA, use_cache=False), results[0],
+        'Cached fragments should be returned from the cache.')
+
+  def test_parse_many(self):
+    sources = [DEFAULT_SENTENCE_JA, u'<a>今日は</a>晴れ。'] * 4
+    results = self.parser.parse_many(sources, use_cache=False, max_workers=3)
+    self.assertEqual(
+        [self.parser.parse(source, use_cache=False) for source in sources],
+        results,
+        'Results should be returned in the order of the sources.')
+
+  def test_parse_many_service_per_thread(self):
+    services = []
+    threads = set()
+
+    def service_factory():
+      service = MagicMock()
+      service.documents().annotateText().execute.return_value = {
+          'tokens': DEFAULT_TOKENS}
+      services.append(service)
+      threads.add(threading.current_thread())
+      return service
+
+    parser = budou.Budou(MagicMock(), service_factory=service_factory,
+                         num_retries=2)
+    results = parser.parse_many(
+        [DEFAULT_SENTENCE_JA] * 8, use_cache=False, max_workers=2)
+    self.assertFalse(
+        parser.service.documents.called,
+        'The service of the parser should not be used by worker threads.')
+    self.assertEqual(
+        len(threads), len(services),
+        'Each worker thread should build its own service.')
+    services[0].documents().annotateText().execute.assert_called_with(
+        num_retries=2)
+    self.assertEqual(
+        [budou.Chunk(u'今日は', u'NOUN', u'NN', True),
+         budou.Chunk(u'晴れ。', u'NOUN', u'ROOT', False)],
+        results[-1]['chunks'],
+        'Worker threads should parse the sources with their services.')
+
+  def test_parse_many_without_service_factory(self):
+    threads = set()
+    service = MagicMock()
+
+    def execute(num_retries):
+      threads.add(threading.current_thread())
+      return {'tokens': DEFAULT_TOKENS}
+
+    service.documents().annotateText().execute.side_effect = execute
+    parser = budou.Budou(service)
+    parser.parse_many([DEFAULT_SENTENCE_JA, u'今日は'], use_cache=False)
+    self.assertEqual(
+        set([threading.current_thread()]), threads,
+        'A service without a factory should not be shared with threads.')
+    service.documents().annotateText().execute.assert_called_with(
+        num_retries=budou.DEFAULT_NUM_RETRIES)
+
+  def test_parse_stream(self):
+    lines = [u'오늘은 맑음. 내일은\n', u' 비. <b>모레는</b>', u' 눈!']
+    result = self.parser.parse_stream(
+        iter(lines), language='ko', use_cache=False, batch_size=2)
+    self.assertEqual(
+        self.parser.parse(
+            u''.join(lines), language='ko', use_cache=False)['html_code'],
+        u''.join(result),
+        'Joined windows should be the same as the whole document parsed.')
+
+  def test_split_windows(self):
+    source = [u'今日は晴れ。<a title="x。', u'y">明日。</a>も', u'晴れ。\n']
+    expected = [(u'今日は晴れ。', True), (u'<a title="x。y">明日。</a>も晴れ。', True),
+                (u'\n', False)]
+    result = list(self.parser._split_windows(source))
+    self.assertEqual(
+        expected, result,
+        'HTML code should be split at the ends of sentences outside elements.')
+
+    source = [u'<div>今日は<p>晴れ<p>明日', u'は<b>雨</b><br>明後日</div>']
+    expected = [
+        (u'<div>', False), (u'今日は', True), (u'<p>', False), (u'晴れ', True),
+        (u'<p>', False), (u'明日は<b>雨</b>', True), (u'<br>', False),
+        (u'明後日', True), (u'</div>', False)]
+    self.assertEqual(
+        expected, list(self.parser._split_windows(source)),
+        'HTML code should be split at block tags, even without end tags.')
+
+  def test_split_windows_incomplete_markup(self):
+    source = io.StringIO(
+        u'<!-- note:\n a > b\n -->\n<p>오늘은 맑음.</p>\n')
+    self.assertEqual(
+        list(self.parser._split_windows(
+            [u'<!-- note:\n a > b\n -->\n<p>오늘은 맑음.</p>\n'])),
+        list(self.parser._split_windows(source)),
+        'A comment should be held back until it ends.')
+    self.assertEqual(
+        [(u'<!-- note:\n a > b\n -->', False), (u'\n', False), (u'<p>', False),
+         (u'오늘은 맑음.', True), (u'</p>', False), (u'\n', False)],
+        list(self.parser._split_windows(io.StringIO(
+            u'<!-- note:\n a > b\n -->\n<p>오늘은 맑음.</p>\n'))))
+
+    data = u'<p>今日は晴れ。</p>'.encode('utf8')
+    self.assertEqual(
+        [(u'<p>', False), (u'今日は晴れ。', True), (u'</p>', False)],
+        list(self.parser._split_windows(
+            [data[i:i + 2] for i in range(0, len(data), 2)])),
+        'Bytes should be decoded across pieces which split a character.')
+
+  def test_parse_stream_document(self):
+    source = (
+        u'<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        u'<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+        u'<title>오늘은 맑음</title></head>\n<body>\n'
+        u'<p>오늘은 맑음.</p>\n<p>내일은 <b>비</b>.</p>\n<p>모레는 눈\n'
+        u'<ul><li>글피는 비<li>그글피는 맑음</ul>\n<p>주말은 흐림.</p>\n'
+        u'</body></html>\n')
+    expected = (
+        u'<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        u'<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+        u'<title>오늘은 맑음</title></head>\n<body>\n'
+        u'<p><span class="ww">오늘은</span> <span class="ww">맑음.</span></p>\n'
+        u'<p><span class="ww">내일은</span> <span class="ww"><b>비</b>.</span>'
+        u'</p>\n<p><span class="ww">모레는</span> <span class="ww">눈</span>'
+        u'<ul><li><span class="ww">글피는</span> <span class="ww">비</span>'
+        u'<li><span class="ww">그글피는</span> <span class="ww">맑음</span>'
+        u'</ul>\n<p><span class="ww">주말은</span> <span class="ww">흐림.</span>'
+        u'</p>\n</body></html>\n')
+    self.parser.parse_batch = MagicMock(wraps=self.parser.parse_batch)
+    result = self.parser.parse_stream(
+        [source[i:i + 10] for i in range(0, len(source), 10)], language='ko',
+        use_cache=False, batch_size=4)
+    self.assertEqual(
+        expected, u''.join(result),
+        'The document outside the blocks should be passed through.')
+    for args, _ in self.parser.parse_batch.call_args_list:
+      self.assertLessEqual(len(args[0]), 4,
+          'A document should be parsed in bounded batches.')
+
+  def test_parse_document(self):
+    source = (
+        u'<!DOCTYPE html><html><head><title>오늘은 맑음</title></head>'
+        u'<body><h1>오늘은 맑음</h1><div>오늘은 맑음</div>'
+        u'<ul><li><p>내일은 <a href="#">비</a>.</p></li></ul>'
+        u'<p>오늘은 맑음</p></body></html>')
+    expected_html_code = (
+        u'<!DOCTYPE html>\n<html><head><title>오늘은 맑음</title></head>'
+        u'<body><h1><span class="ww">오늘은</span> <span class="ww">맑음</span>'
+        u'</h1><div>오늘은 맑음</div><ul><li><p><span class="ww">내일은</span> '
+        u'<span class="ww"><a href="#">비</a>.</span></p></li></ul>'
+        u'<p><span class="ww">오늘은</span> <span class="ww">맑음</span></p>'
+        u'</body></html>')
+    self.parser.parse_batch = MagicMock(wraps=self.parser.parse_batch)
+    result = self.parser.parse_document(source, language='ko', use_cache=False)
+    self.assertEqual(
+        expected_html_code, result['html_code'],
+        'Only the innermost selected blocks should be processed.')
+    self.assertEqual(
+        3, len(result['chunks']),
+        'The chunks of every processed block should be returned.')
+    self.assertEqual(
+        2, len(self.parser.parse_batch.call_args[0][0]),
+        'Blocks with the same content should be parsed once.')
+
+  def test_parse_document_nested(self):
+    source = (
+        u'<html><body><ul><li>오늘은 <b>맑음</b><ul><li>내일은 비</li></ul>'
+        u'모레는 눈</li></ul></body></html>')
+    expected_html_code = (
+        u'<html><body><ul><li><span class="ww">오늘은</span> '
+        u'<span class="ww"><b>맑음</b></span><ul><li><span class="ww">내일은'
+        u'</span> <span class="ww">비</span></li></ul><span class="ww">모레는'
+        u'</span> <span class="ww">눈</span></li></ul></body></html>')
+    result = self.parser.parse_document(source, language='ko', use_cache=False)
+    self.assertEqual(
+        expected_html_code, result['html_code'],
+        'The text around nested blocks should be processed as well.')
+    self.assertEqual(3, len(result['chunks']))
+
+  def test_parse_document_without_doctype(self):
+    source = u'<html><body><p>오늘은 맑음</p></body></html>'
+    result = self.parser.parse_document(source, language='ko', use_cache=False)
+    self.assertEqual(
+        u'<html><body><p><span class="ww">오늘은</span> '
+        u'<span class="ww">맑음</span></p></body></html>',
+        result['html_code'],
+        'A doctype should not be added to a document without one.')
+
+  def test_parse_document_escaped_text(self):
+    source = (u'<html><body><p>예：&lt;script&gt;alert(1)&lt;/script&gt; '
+              u'<b>a &amp; b</b> &amp;</p></body></html>')
+    result = self.parser.parse_document(source, language='ko', use_cache=False)
+    self.assertEqual(
+        u'<html><body><p><span class="ww">예：&lt;script&gt;alert(1)&lt;/script'
+        u'&gt;</span> <span class="ww"><b>a &amp; b</b></span> '
+        u'<span class="ww">&amp;</span></p></body></html>',
+        result['html_code'],
+        'Escaped text should stay escaped instead of becoming elements.')
+    self.assertEqual(
+        u'<span class="ww">1&lt;2</span> <span class="ww"><i>&lt;i&gt;</i>'
+        u'&amp;</span>',
+        self.parser.parse(u'1&lt;2 <i>&lt;i&gt;</i>&amp;', language='ko',
+                          use_cache=False)['html_code'],
+        'The text of chunks should be escaped.')
+
+  def test_parse_document_selector(self):
+    try:
+      import cssselect
+    except ImportError:
+      self.skipTest('cssselect is not available.')
+    source = u'<html><body><p>오늘은</p><p class="a">맑음</p></body></html>'
+    result = self.parser.parse_document(
+        source, language='ko', use_cache=False, selector='p.a')
+    self.assertIn(
+        u'<p>오늘은</p><p class="a"><span class="ww">맑음</span></p>',
+        result['html_code'],
+        'Blocks should be selected by the CSS selector.')
+
   def test_preprocess(self):
     source = u' a\nb<br> c   d'
     expected = u'ab c d'
@@ -146,6 +458,17 @@ class TestBudouMethods(unittest.TestCase):
         expected, result,
         'Input sentence should be processed into source chunks.')
 
+  def test_get_chunks_from_tokens_with_equal_tokens(self):
+    token = {
+        u'text': {u'content': u'a', u'beginOffset': 0},
+        u'dependencyEdge': {u'headTokenIndex': 1, u'label': u'NN'},
+        u'partOfSpeech': {u'tag': u'NOUN'},
+    }
+    result = self.parser._get_chunks_from_tokens([token, copy.deepcopy(token)])
+    self.assertEqual(
+        [True, False], [chunk.forward for chunk in result],
+        'The direction should be decided by the position of each token.')
+
   def test_migrate_html(self):
     source = u'こ<a>ちらを</a>クリック'
     dom = html.fragment_fromstring(source, create_parent='body')
@@ -165,6 +488,37 @@ class TestBudouMethods(unittest.TestCase):
         expected, result,
         'The HTML source code should be migrated into the chunk list.')
 
+  def test_migrate_html_multiple_elements(self):
+    source = u'<b>こ</b>ちら<a>を</a>ク<i>リック</i>'
+    dom = html.fragment_fromstring(source, create_parent='body')
+    chunks = [
+        budou.Chunk(u'こちら', u'PRON', u'NSUBJ', True),
+        budou.Chunk(u'を', u'PRT', u'PRT', False),
+        budou.Chunk(u'クリ', u'NOUN', u'ROOT', False),
+        budou.Chunk(u'ック', u'NOUN', u'ROOT', False),
+    ]
+    expected = [
+        budou.Chunk(u'<b>こ</b>ちら', budou.HTML_POS, budou.HTML_POS, True),
+        budou.Chunk(u'<a>を</a>', budou.HTML_POS, budou.HTML_POS, True),
+        budou.Chunk(u'ク<i>リック</i>', budou.HTML_POS, budou.HTML_POS, True),
+    ]
+    result = self.parser._migrate_html(chunks, dom)
+    self.assertEqual(
+        expected, result,
+        'Every HTML element should be migrated into the chunk list.')
+
+  def test_migrate_html_repeated_text(self):
+    source = u'ab<a>ab</a>'
+    dom = html.fragment_fromstring(source, create_parent='body')
+    chunks = [budou.Chunk(u'abab', u'NOUN', u'ROOT', False)]
+    expected = [
+        budou.Chunk(u'ab<a>ab</a>', budou.HTML_POS, budou.HTML_POS, True),
+    ]
+    result = self.parser._migrate_html(chunks, dom)
+    self.assertEqual(
+        expected, result,
+        'The HTML source should replace the text at the offset of the element.')
+
   def test_get_elements_list(self):
     source = u'<a>こちら</a>をクリック'
     dom = html.fragment_fromstring(source, create_parent='body')
@@ -194,6 +548,36 @@ class TestBudouMethods(unittest.TestCase):
         result, expected,
         'The chunks should be compiled to a HTML code.')
 
+  def test_spanize_escape(self):
+    chunks = [budou.Chunk(u'a', None, None, None)]
+    attributes = {
+        'class': 'foo',
+        'title': u'"a" & <b>',
+    }
+    expected = (
+        u'<span class="foo" title="&quot;a&quot; &amp; &lt;b&gt;">a</span>')
+    result = self.parser._spanize(chunks, attributes)
+    self.assertEqual(
+        result, expected,
+        'Attribute values should be escaped.')
+
+  def test_render_stream(self):
+    chunks = [
+        budou.Chunk(u'a', None, None, None),
+        budou.Chunk(u' ', budou.SPACE_POS, budou.SPACE_POS, True),
+        budou.Chunk(u'b', None, None, None),
+    ]
+    stream = io.StringIO()
+    stream.write(u'<p>')
+    result = self.parser.render(chunks, 'foo', stream=stream)
+    self.assertIsNone(
+        result,
+        'Nothing should be returned when rendering into a stream.')
+    self.assertEqual(
+        u'<p><span class="foo">a</span> <span class="foo">b</span>',
+        stream.getvalue(),
+        'The HTML code should be written into the stream.')
+
   def test_concatenate_punctuations(self):
     chunks = [
         budou.Chunk(u'a', None, None, None),
@@ -234,6 +618,24 @@ class TestBudouMethods(unittest.TestCase):
         'Backward directional chunks should be concatenated to preceding '
         'chunks.')
 
+  def test_concatenate_chunks(self):
+    labels = list(budou.TARGET_LABEL[:3]) + [u'NN', u'ROOT', budou.SPACE_POS]
+    random.seed(0)
+    for _ in range(500):
+      chunks = [
+          budou.Chunk(
+              u'%d' % i, random.choice([u'NOUN', u'PUNCT', u'PRT']),
+              random.choice(labels), random.choice([True, False, None]))
+          for i in range(random.randint(0, 12))]
+      expected = self.parser._concatenate_punctuations(chunks)
+      expected = self.parser._concatenate_by_label(expected, True)
+      expected = self.parser._concatenate_by_label(expected, False)
+      result = self.parser._concatenate_chunks(chunks)
+      self.assertEqual(
+          expected, result,
+          'The fused concatenation should be equivalent to the three passes '
+          'for %r.' % (chunks,))
+
   def test_cache(self):
     expected_chunks = [
         budou.Chunk(u'今日は', u'NOUN', u'NN', True),
@@ -258,6 +660,93 @@ class TestBudouMethods(unittest.TestCase):
         expected_html_code, result['html_code'],
         'Processed result should include expected html code.')
 
+  def test_cache_key(self):
+    with patch('budou.budou.cache', budou.MemoryLRUCache()):
+      self.parser.parse(u'今日は\n晴れ。', language='ja')
+      result = self.parser.parse(
+          u'今日は\n晴れ。', 'foo', language='ja', use_cache=True)
+    self.assertEqual(
+        1, self.parser._get_annotations.call_count,
+        'Sources with line breaks should hit the cache.')
+    self.assertEqual(
+        u'<span class="foo">今日は</span><span class="foo">晴れ。</span>',
+        result['html_code'],
+        'HTML code should be rendered with the given attributes on a hit.')
+
+  def test_cache_encoding(self):
+    cache = budou.MemoryLRUCache()
+    with patch('budou.budou.cache', cache):
+      expected = self.parser.parse(DEFAULT_SENTENCE_JA, language='ja')
+      value = cache.get(DEFAULT_SENTENCE_JA, 'ja:api')
+      self.assertIsInstance(
+          value, bytes, 'Chunks should be stored in the encoded form.')
+      self.assertEqual(
+          expected, self.parser.parse(DEFAULT_SENTENCE_JA, language='ja'))
+      self.assertEqual(1, self.parser._get_annotations.call_count)
+
+      cache.set(
+          DEFAULT_SENTENCE_JA, 'ja:api', [budou.Chunk(u'x', '', '', True)])
+      self.assertEqual(
+          expected, self.parser.parse(DEFAULT_SENTENCE_JA, language='ja'),
+          'Values in an unknown format should be treated as missing.')
+      self.assertEqual(2, self.parser._get_annotations.call_count)
+
+  def test_cache_markup_variants(self):
+    with patch('budou.budou.cache', budou.MemoryLRUCache()):
+      self.parser.parse(u'<a>今日は</a>晴れ。', language='ja')
+      result = self.parser.parse(u'今日は<b>晴れ</b>。', language='ja')
+    self.assertEqual(
+        1, self.parser._get_annotations.call_count,
+        'Sources with the same text should share the cached chunks.')
+    self.assertEqual(
+        u'<span class="ww">今日は</span><span class="ww"><b>晴れ</b>。</span>',
+        result['html_code'],
+        'HTML elements should be migrated to the cached chunks.')
+
+  def test_cache_instance(self):
+    cache = budou.MemoryLRUCache()
+    parser = budou.Budou(None, cache=cache)
+    parser._get_annotations = MagicMock(return_value=DEFAULT_TOKENS)
+    with patch('budou.budou.get_cache') as get_cache:
+      parser.parse(DEFAULT_SENTENCE_JA, language='ja')
+      parser.parse_batch([DEFAULT_SENTENCE_JA, u'晴れ'], language='ja')
+      self.assertFalse(get_cache.called,
+          'The shared cache should not be loaded for a parser with a cache.')
+    self.assertIsNotNone(cache.get(DEFAULT_SENTENCE_JA, 'ja:api'))
+    self.assertIsNotNone(cache.get(u'晴れ', 'ja:api'))
+    self.assertEqual(2, parser._get_annotations.call_count)
+
+  def test_result_chunks(self):
+    result = self.parser.parse(
+        DEFAULT_SENTENCE_JA, language='ja', use_cache=False)
+    self.assertIsInstance(result['chunks'], list,
+        'Chunks should be returned as a list.')
+    json.dumps(result['chunks'])
+    result['chunks'].append(budou.Chunk(u'x', None, None, False))
+
+  def test_cache_engine(self):
+    cache = budou.MemoryLRUCache()
+    offline_parser = budou.Budou(
+        None, segmenter=budou.JapaneseSegmenter(), cache=cache)
+    offline_parser.parse(DEFAULT_SENTENCE_JA, language='ja')
+    offline_parser.parse_batch([u'晴れ'], language='ja')
+    parser = budou.Budou(None, cache=cache)
+    parser._get_annotations = MagicMock(return_value=DEFAULT_TOKENS)
+    parser.parse(DEFAULT_SENTENCE_JA, language='ja')
+    parser.parse_batch([u'晴れ'], language='ja')
+    self.assertEqual(2, parser._get_annotations.call_count,
+        'Chunks of a segmenter should not be served to a parser using the API.')
+
+  def test_cache_disabled(self):
+    parser = budou.Budou(None, cache=None)
+    parser._get_annotations = MagicMock(return_value=DEFAULT_TOKENS)
+    with patch('budou.budou.get_cache') as get_cache:
+      parser.parse(DEFAULT_SENTENCE_JA, language='ja')
+      parser.parse_batch([DEFAULT_SENTENCE_JA], language='ja')
+      self.assertFalse(get_cache.called)
+    self.assertEqual(2, parser._get_annotations.call_count,
+        'Chunks should not be cached for a parser without a cache.')
+
   def test_get_attribute_dict(self):
     result = self.parser._get_attribute_dict({})
     self.assertEqual(
@@ -330,5 +819,222 @@ class TestBudouMethods(unittest.TestCase):
         'Input text should be parsed into chunks separated by spaces.')
 
 
+class TestLazyImports(unittest.TestCase):
+
+  def test_import(self):
+    script = (
+        'import sys, budou\n'
+        'budou.Budou(None).parse(u"a b", language="ko", use_cache=False)\n'
+        'print(budou.budou.cache is None)\n'
+        'print(" ".join(name for name in ("googleapiclient.discovery", '
+        '"oauth2client.client", "httplib2", "asyncio") '
+        'if name in sys.modules))\n')
+    output = subprocess.check_output([sys.executable, '-c', script])
+    self.assertEqual(
+        output.decode('utf8').split('\n')[:2], ['True', ''],
+        'The API client, the cache and asyncio should not be loaded until '
+        'they are used.')
+
+  def test_get_cache(self):
+    with patch('budou.budou.cache', None):
+      cache = budou.get_cache()
+      self.assertIsNotNone(cache)
+      self.assertIs(budou.get_cache(), cache)
+
+
+class TestService(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.temp_dir, 'discovery.json')
+    self.http = MagicMock()
+    self.http.request.return_value = (
+        MagicMock(status=200), DISCOVERY_DOCUMENT.encode('utf8'))
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+    budou.budou._discovery_documents.clear()
+
+  def test_get_discovery_document(self):
+    document = budou.get_discovery_document(self.path, self.http)
+    self.assertEqual(document, DISCOVERY_DOCUMENT)
+    self.http.request.assert_called_once_with(budou.DISCOVERY_URL)
+    with io.open(self.path, encoding='utf8') as f:
+      self.assertEqual(f.read(), DISCOVERY_DOCUMENT,
+                       'The fetched document should be saved to the file.')
+
+    budou.get_discovery_document(self.path, self.http)
+    self.assertEqual(self.http.request.call_count, 1,
+                     'The document should be kept in memory.')
+
+    budou.budou._discovery_documents.clear()
+    self.assertEqual(
+        budou.get_discovery_document(self.path, self.http), DISCOVERY_DOCUMENT)
+    self.assertEqual(self.http.request.call_count, 1,
+                     'The document should be read from the file.')
+
+  def test_get_discovery_document_broken_file(self):
+    with io.open(self.path, 'w', encoding='utf8') as f:
+      f.write(u'{"rootUrl":')
+    self.assertEqual(
+        budou.get_discovery_document(self.path, self.http), DISCOVERY_DOCUMENT)
+    self.http.request.assert_called_once_with(budou.DISCOVERY_URL)
+
+  def test_get_discovery_document_other_host(self):
+    with io.open(self.path, 'w', encoding='utf8') as f:
+      f.write(DISCOVERY_DOCUMENT.replace(
+          'https://language.googleapis.com/', 'https://example.com/'))
+    self.assertEqual(
+        budou.get_discovery_document(self.path, self.http), DISCOVERY_DOCUMENT,
+        'A document pointing at another host should not be trusted.')
+    self.http.request.assert_called_once_with(budou.DISCOVERY_URL)
+
+    budou.budou._discovery_documents.clear()
+    os.remove(self.path)
+    self.http.request.return_value = (
+        MagicMock(status=200), b'{"rootUrl": "http://language.googleapis.com/"}')
+    with self.assertRaises(ValueError):
+      budou.get_discovery_document(self.path, self.http)
+
+  def test_get_discovery_document_default_path(self):
+    with patch.dict(os.environ, {'XDG_CACHE_HOME': self.temp_dir}):
+      budou.get_discovery_document(http=self.http)
+    directory = os.path.join(self.temp_dir, 'budou')
+    self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700,
+                     'The cache directory should be private to the user.')
+    self.assertTrue(os.path.exists(
+        os.path.join(directory, budou.budou.DISCOVERY_CACHE_FILE_NAME)))
+
+  def test_service_factory(self):
+    factory = budou.ServiceFactory(discovery_document=DISCOVERY_DOCUMENT)
+    service = factory()
+    request = service.documents().annotateText(body={})
+    self.assertEqual(request.method, 'POST')
+    self.assertIs(factory(), service,
+                  'A thread should reuse its service.')
+
+    services = []
+    thread = threading.Thread(target=lambda: services.append(factory()))
+    thread.start()
+    thread.join()
+    self.assertIsNot(services[0], service,
+                     'Other threads should use their own services.')
+
+    parser = budou.Budou.authenticate(service_factory=factory)
+    self.assertIs(parser.service, service,
+                  'Parsers should share the services of the factory.')
+
+
+class TestChunkList(unittest.TestCase):
+
+  def setUp(self):
+    self.chunks = [
+        budou.Chunk(u'今日は', u'NOUN', u'NN', True),
+        budou.Chunk(u' ', budou.SPACE_POS, budou.SPACE_POS, True),
+        budou.Chunk(u'晴れ。', u'NOUN', u'ROOT', False),
+        budou.Chunk(u'a', None, None, None),
+    ]
+    self.chunk_list = budou.ChunkList(self.chunks)
+
+  def test_sequence(self):
+    self.assertEqual(
+        len(self.chunks), len(self.chunk_list),
+        'The length should be the number of chunks.')
+    self.assertEqual(
+        self.chunks, list(self.chunk_list),
+        'Iteration should return the chunks.')
+    self.assertEqual(
+        self.chunks[2], self.chunk_list[2],
+        'Indexing should return the chunk.')
+    self.assertEqual(
+        self.chunks[-1], self.chunk_list[-1],
+        'Negative indexing should return the chunk from the end.')
+    self.assertEqual(
+        self.chunks[1:3], self.chunk_list[1:3],
+        'Slicing should return the chunks in the range.')
+    with self.assertRaises(IndexError):
+      self.chunk_list[len(self.chunks)]
+
+  def test_equality(self):
+    self.assertEqual(
+        self.chunk_list, self.chunks,
+        'A chunk list should be equal to the list of the same chunks.')
+    self.assertNotEqual(
+        self.chunk_list, self.chunks[:-1],
+        'A chunk list should not be equal to a list of other chunks.')
+
+  def test_pickle(self):
+    result = pickle.loads(pickle.dumps(self.chunk_list))
+    self.assertEqual(
+        self.chunk_list, result,
+        'A chunk list should be restored from the pickled data.')
+
+  def test_bytes(self):
+    for compression in (None, 'zlib'):
+      data = self.chunk_list.to_bytes(compression)
+      self.assertEqual(
+          budou.ChunkList.from_bytes(data), self.chunks,
+          'A chunk list should be restored from the encoded data.')
+    chunks = [budou.Chunk(u'今日%d' % i, u'NOUN', u'NN', i % 2 == 0)
+              for i in range(100)]
+    chunk_list = budou.ChunkList(chunks)
+    self.assertLess(
+        len(chunk_list.to_bytes('zlib')), len(chunk_list.to_bytes(None)),
+        'Compression should make long chunk lists smaller.')
+    self.assertLess(
+        len(chunk_list.to_bytes(None)), len(pickle.dumps(chunks)),
+        'The encoding should be smaller than the pickled chunks.')
+    self.assertEqual(
+        budou.ChunkList.from_bytes(chunk_list.to_bytes('zlib')), chunks)
+    self.assertEqual(budou.ChunkList([]).to_bytes(None)[:3],
+                     budou.CHUNKS_FORMAT_MAGIC + b'\x01')
+
+  def test_bytes_lz4(self):
+    try:
+      import lz4.frame
+    except ImportError:
+      self.skipTest('lz4 is not installed.')
+    chunk_list = budou.ChunkList(self.chunks * 10)
+    self.assertEqual(
+        budou.ChunkList.from_bytes(chunk_list.to_bytes('lz4')), chunk_list)
+
+  def test_bytes_invalid(self):
+    data = self.chunk_list.to_bytes(None)
+    start = len(budou.CHUNKS_FORMAT_MAGIC)
+    for invalid in (
+        b'', b'banana', self.chunks,
+        data[:start] + b'\x02' + data[start + 1:],
+        data[:start + 1] + b'\x09' + data[start + 2:],
+        data[:start + 1] + b'\x01' + data[start + 2:],
+        data[:-10]):
+      with self.assertRaises(ValueError):
+        budou.ChunkList.from_bytes(invalid)
+
+  def test_bytes_invalid_codes(self):
+    header = budou.CHUNKS_FORMAT_MAGIC + bytearray(
+        [budou.CHUNKS_FORMAT_VERSION, 0])
+    for payload in (
+        u'["a",[1],["NOUN"],[0],[0],[7]]',
+        u'["a",[1],["NOUN"],[0],[0],[true]]',
+        u'["a",[1],["NOUN"],[1],[0],[0]]',
+        u'["a",[1],["NOUN"],[0],[-1],[0]]',
+        u'["a",[1],["NOUN"],["0"],[0],[0]]',
+        u'[["a"],[1],["NOUN"],[0],[0],[0]]'):
+      with self.assertRaises(ValueError):
+        budou.ChunkList.from_bytes(bytes(header + payload.encode('utf8')))
+    self.assertEqual(
+        budou.ChunkList.from_bytes(bytes(
+            header + u'["a",[1],["NOUN"],[0],[0],[1]]'.encode('utf8'))),
+        [budou.Chunk(u'a', u'NOUN', u'NOUN', True)])
+
+    parser = budou.Budou(None, cache=budou.MemoryLRUCache())
+    parser._get_annotations = MagicMock(return_value=DEFAULT_TOKENS)
+    parser.cache.set(DEFAULT_SENTENCE_JA, 'ja:api', bytes(
+        header + u'["a",[1],["NOUN"],[0],[0],[7]]'.encode('utf8')))
+    parser.parse(DEFAULT_SENTENCE_JA, language='ja')
+    self.assertEqual(1, parser._get_annotations.call_count,
+        'Corrupt cached chunks should be treated as missing.')
+
+
 if __name__ == '__main__':
   unittest.main()
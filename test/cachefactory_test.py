@@ -14,8 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from mock import MagicMock
+from mock import patch
 import unittest
 import os
+import shutil
+import tempfile
 import budou
 
 class TestStandardCacheFactory(unittest.TestCase):
@@ -54,6 +58,285 @@ class TestStandardCacheFactory(unittest.TestCase):
         self.cache.get('a', 'en'), self.cache.get('a', 'ja'),
         'The cached key should be unique per language.')
 
+  def test_set_many_and_get_many(self):
+    self.cache.set_many({'a': 1, 'b': 2}, 'en')
+    self.assertEqual(self.cache.get_many(['b', 'c', 'a'], 'en'), [2, None, 1],
+        'Values should be returned in the order of the sources.')
+    self.assertEqual(self.cache.get('a', 'en'), 1,
+        'Values set together should be read one by one.')
+
+
+class TestPersistentShelveCache(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'cache')
+    self.cache = budou.PersistentShelveCache(self.filename)
+
+  def tearDown(self):
+    self.cache.close()
+    shutil.rmtree(self.directory)
+
+  def test_set_and_get(self):
+    self.cache.set('apple', 'a', 'banana')
+    self.assertEqual(self.cache.get('apple', 'a'), 'banana',
+        'The target should be cached.')
+    self.assertIsNone(self.cache.get('apple', 'b'),
+        'The cached key should be unique per language.')
+
+  def test_close(self):
+    self.cache.set('apple', 'a', 'banana')
+    self.cache.close()
+    with budou.PersistentShelveCache(self.filename) as cache:
+      self.assertEqual(cache.get('apple', 'a'), 'banana',
+          'The target should be persisted in the file.')
+    self.assertEqual(self.cache.get('apple', 'a'), 'banana',
+        'A closed cache should be reopened on access.')
+
+  def test_shared_file(self):
+    other_cache = budou.PersistentShelveCache(self.filename)
+    self.assertIsNone(other_cache.get('apple', 'a'),
+        'The target should not be cached yet.')
+    self.cache.set('apple', 'a', 'banana')
+    self.assertEqual(other_cache.get('apple', 'a'), 'banana',
+        'Writes through another handle should be visible.')
+    other_cache.close()
+
+  def test_set_many_and_get_many(self):
+    other_cache = budou.PersistentShelveCache(self.filename)
+    self.cache.set_many({'a': 1, 'b': 2}, 'en')
+    self.assertEqual(other_cache.get_many(['b', 'c', 'a'], 'en'), [2, None, 1],
+        'Values should be returned in the order of the sources.')
+    other_cache.close()
+
+  def test_lock_file(self):
+    self.cache.set('apple', 'a', 'banana')
+    mode = os.stat(self.filename + '.lock').st_mode
+    self.assertFalse(mode & 0o111, 'The lock file should not be executable.')
+
+  @unittest.skipIf(budou.cachefactory.fcntl is None, 'fcntl is unavailable.')
+  def test_shared_lock(self):
+    fcntl = budou.cachefactory.fcntl
+    self.cache.set('apple', 'a', 'banana')
+    with patch.object(fcntl, 'flock') as flock:
+      self.cache.get('apple', 'a')
+      self.cache.get_many(['apple'], 'a')
+    operations = [args[1] for args, _ in flock.call_args_list]
+    self.assertEqual(
+        operations,
+        [fcntl.LOCK_SH, fcntl.LOCK_UN, fcntl.LOCK_SH, fcntl.LOCK_UN],
+        'Reads should take a shared lock.')
+
+
+class TestMemoryLRUCache(unittest.TestCase):
+
+  def test_set_and_get(self):
+    cache = budou.MemoryLRUCache()
+    cache.set('apple', 'a', 'banana')
+    self.assertEqual(cache.get('apple', 'a'), 'banana',
+        'The target should be cached.')
+    self.assertIsNone(cache.get('apple', 'b'),
+        'The cached key should be unique per language.')
+
+  def test_max_entries(self):
+    cache = budou.MemoryLRUCache(max_entries=2)
+    cache.set('a', 'en', 1)
+    cache.set('b', 'en', 2)
+    cache.get('a', 'en')
+    cache.set('c', 'en', 3)
+    self.assertIsNone(cache.get('b', 'en'),
+        'The least recently used entry should be evicted.')
+    self.assertEqual(cache.get('a', 'en'), 1,
+        'Recently used entries should be kept.')
+    self.assertEqual(len(cache), 2,
+        'The number of entries should not exceed the limit.')
+
+  def test_max_bytes(self):
+    cache = budou.MemoryLRUCache(max_entries=None, max_bytes=150)
+    cache.set('a', 'en', 'x' * 40)
+    cache.set('b', 'en', 'x' * 40)
+    cache.set('c', 'en', 'x' * 40)
+    self.assertIsNone(cache.get('a', 'en'),
+        'Old entries should be evicted to fit in the size limit.')
+    self.assertEqual(len(cache), 2,
+        'Entries within the size limit should be kept.')
+    cache.set('d', 'en', 'x' * 200)
+    self.assertIsNone(cache.get('d', 'en'),
+        'A value larger than the size limit should not be cached.')
+
+  def test_ttl(self):
+    cache = budou.MemoryLRUCache(ttl=10)
+    with patch('time.time', return_value=100):
+      cache.set('a', 'en', 1)
+    with patch('time.time', return_value=105):
+      self.assertEqual(cache.get('a', 'en'), 1,
+          'Entries should be valid until they expire.')
+    with patch('time.time', return_value=110):
+      self.assertIsNone(cache.get('a', 'en'),
+          'Expired entries should not be returned.')
+
+  def test_set_many_and_get_many(self):
+    cache = budou.MemoryLRUCache(max_entries=2)
+    cache.set_many({'a': 1}, 'en')
+    cache.set_many({'b': 2, 'c': 3}, 'EN')
+    self.assertEqual(cache.get_many(['c', 'b', 'a'], 'en'), [3, 2, None],
+        'The limits should apply to values set together.')
+
+
+class TestTieredCache(unittest.TestCase):
+
+  def setUp(self):
+    self.l1 = budou.MemoryLRUCache()
+    self.l2 = budou.MemoryLRUCache()
+    self.cache = budou.TieredCache(self.l1, self.l2)
+
+  def test_write_through(self):
+    self.cache.set('apple', 'a', 'banana')
+    self.assertEqual(self.l1.get('apple', 'a'), 'banana',
+        'The target should be written to the first level.')
+    self.assertEqual(self.l2.get('apple', 'a'), 'banana',
+        'The target should be written to the second level.')
+
+  def test_read_through(self):
+    self.l2.set('apple', 'a', 'banana')
+    self.assertEqual(self.cache.get('apple', 'a'), 'banana',
+        'The target should be read from the second level.')
+    self.assertEqual(self.l1.get('apple', 'a'), 'banana',
+        'The first level should be filled on a miss.')
+
+  def test_get_many(self):
+    self.l1.set('a', 'en', 1)
+    self.l2.set_many({'a': 10, 'b': 2}, 'en')
+    self.assertEqual(self.cache.get_many(['a', 'b', 'c'], 'en'), [1, 2, None],
+        'Values should be read from the first level, then the second level.')
+    self.assertEqual(self.l1.get('b', 'en'), 2,
+        'The first level should be filled on misses.')
+
+  def test_set_many(self):
+    self.cache.set_many({'a': 1}, 'en')
+    self.assertEqual(self.l1.get('a', 'en'), 1)
+    self.assertEqual(self.l2.get('a', 'en'), 1)
+
+
+class TestAppEngineCache(unittest.TestCase):
+
+  def setUp(self):
+    self.memcache = MagicMock()
+    self.cache = budou.cachefactory.AppEngineCache(self.memcache)
+
+  def test_get_many(self):
+    key_a = self.cache._get_cache_key('a', 'en')
+    key_b = self.cache._get_cache_key('b', 'en')
+    self.memcache.get_multi.return_value = {key_b: 2}
+    self.assertEqual(self.cache.get_many(['a', 'b'], 'en'), [None, 2])
+    self.memcache.get_multi.assert_called_once_with([key_a, key_b])
+    self.assertFalse(self.memcache.get.called,
+        'Values should be fetched in a single call.')
+
+  def test_set_many(self):
+    self.cache.set_many({'a': 1, 'b': 2}, 'en')
+    self.memcache.set_multi.assert_called_once_with({
+        self.cache._get_cache_key('a', 'en'): 1,
+        self.cache._get_cache_key('b', 'en'): 2})
+
+
+class FakeRedis(object):
+  """An in-process stand-in for redis.Redis which counts round trips."""
+
+  def __init__(self):
+    self.values = {}
+    self.expires = {}
+    self.round_trips = 0
+
+  def get(self, key):
+    self.round_trips += 1
+    return self.values.get(key)
+
+  def mget(self, keys):
+    self.round_trips += 1
+    return [self.values.get(key) for key in keys]
+
+  def set(self, key, value, ex=None):
+    self.round_trips += 1
+    self._set(key, value, ex)
+
+  def pipeline(self, transaction=True):
+    return FakePipeline(self)
+
+  def _set(self, key, value, ex):
+    self.values[key] = value
+    self.expires[key] = ex
+
+
+class FakePipeline(object):
+
+  def __init__(self, client):
+    self.client = client
+    self.commands = []
+
+  def set(self, key, value, ex=None):
+    self.commands.append((key, value, ex))
+
+  def execute(self):
+    self.client.round_trips += 1
+    for command in self.commands:
+      self.client._set(*command)
+    self.commands = []
+
+
+class TestRedisCache(unittest.TestCase):
+
+  def setUp(self):
+    self.client = FakeRedis()
+    self.cache = budou.RedisCache(self.client, ttl=60)
+
+  def test_set_and_get(self):
+    self.cache.set('a', 'en', b'\x80\x03}q\x00.')
+    self.assertEqual(self.cache.get('a', 'en'), b'\x80\x03}q\x00.',
+        'Values should be stored as they are, without pickling.')
+    self.assertIsNone(self.cache.get('a', 'ja'))
+    key = list(self.client.values)[0]
+    self.assertTrue(key.startswith('budou:%s:' % budou.CACHE_SALT),
+        'Keys should be namespaced with the salt.')
+    self.assertEqual(self.client.expires[key], 60)
+    with self.assertRaises(TypeError):
+      self.cache.set('a', 'en', {'b': 1})
+
+  def test_get_many(self):
+    self.cache.set_many({'a': b'1', 'b': b'2'}, 'en')
+    self.client.round_trips = 0
+    self.assertEqual(
+        self.cache.get_many(['a', 'b', 'c'], 'en'), [b'1', b'2', None])
+    self.assertEqual(self.client.round_trips, 1,
+        'Values should be fetched in a single round trip.')
+    self.assertEqual(self.cache.get_many([], 'en'), [])
+
+  def test_set_many(self):
+    self.cache.set_many({'a': b'1', 'b': b'2', 'c': b'3'}, 'en')
+    self.assertEqual(self.client.round_trips, 1,
+        'Values should be written in a single round trip.')
+    self.assertEqual(self.cache.get('c', 'en'), b'3')
+
+  def test_load_cache(self):
+    with patch.dict(os.environ, {
+        'BUDOU_CACHE': 'redis', 'BUDOU_CACHE_TTL': '30'}):
+      cache = budou.load_cache(client=self.client)
+    self.assertIsInstance(cache, budou.RedisCache)
+    self.assertEqual(cache.ttl, 30)
+    self.assertIsInstance(
+        budou.load_cache('memory', max_entries=2), budou.MemoryLRUCache)
+    with self.assertRaises(ValueError):
+      budou.load_cache('unknown')
+
+  def test_register_cache_backend(self):
+    budou.register_cache_backend('fake_redis', lambda **kwargs: budou.RedisCache(
+        self.client, **kwargs))
+    self.addCleanup(budou.cachefactory._backends.pop, 'fake_redis')
+    cache = budou.load_cache('fake_redis', ttl=10)
+    self.assertIs(cache.client, self.client)
+    self.assertEqual(cache.ttl, 10)
+
+
 if __name__ == '__main__':
   unittest.main()
 
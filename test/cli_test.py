@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from budou import cli
+from mock import patch
+import budou
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestCli(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.cache_path = os.path.join(self.temp_dir, 'cache.shelve')
+    self.output_path = os.path.join(self.temp_dir, 'output.jsonl')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def write_input(self, name, text):
+    path = os.path.join(self.temp_dir, name)
+    with io.open(path, 'w', encoding='utf8') as f:
+      f.write(text)
+    return path
+
+  def run_cli(self, *args):
+    argv = ['--offline', '--cache', self.cache_path, '-o', self.output_path,
+            '-q'] + list(args)
+    with patch('budou.budou.cache', None):
+      self.assertEqual(cli.main(argv), 0)
+      self.assertIsNone(budou.budou.cache,
+          'The shared cache should not be loaded by the command.')
+    with io.open(self.output_path, encoding='utf8') as f:
+      return [json.loads(line) for line in f]
+
+  def test_default_cache_file(self):
+    options = cli.get_argument_parser().parse_args([])
+    self.assertNotEqual(
+        options.cache, budou.SHELVE_CACHE_FILE_NAME,
+        'The command should not write to the default cache of parsers.')
+
+  def test_lines(self):
+    path = self.write_input(
+        'input.txt', u'今日は晴れ。\n\n오늘은 <b>맑음</b>.\n')
+    records = self.run_cli('-p', '1', path)
+    self.assertEqual(
+        [record['source'] for record in records],
+        [u'今日は晴れ。', u'오늘은 <b>맑음</b>.'])
+    self.assertEqual(
+        records[0]['html_code'],
+        u'<span class="ww">今日は</span><span class="ww">晴れ。</span>')
+    self.assertEqual(
+        records[0]['chunks'][0],
+        {'word': u'今日は', 'pos': 'NOUN', 'label': 'NN', 'forward': False})
+
+  def test_jsonl(self):
+    path = self.write_input(
+        'input.jsonl',
+        u'{"id": 1, "text": "今日は晴れ。"}\n{"id": 2, "text": "ご飯を食べた"}\n')
+    records = self.run_cli('-p', '1', '--format', 'jsonl', '--key', 'text',
+                           path)
+    self.assertEqual([record['id'] for record in records], [1, 2])
+    self.assertEqual(
+        records[1]['html_code'],
+        u'<span class="ww">ご飯を</span><span class="ww">食べた</span>')
+
+  def test_files(self):
+    paths = [self.write_input('a.html', u'<p>今日は晴れ。</p>\n'),
+             self.write_input('b.html', u'ご飯を食べた')]
+    records = self.run_cli('-p', '1', '--format', 'file', *paths)
+    self.assertEqual([record['file'] for record in records], paths)
+
+  def test_processes(self):
+    sources = [u'今日は晴れ%d。' % i for i in range(50)]
+    path = self.write_input('input.txt', u'\n'.join(sources))
+    records = self.run_cli('-p', '3', '--batch-size', '7', path)
+    self.assertEqual([record['source'] for record in records], sources,
+                     'The output should keep the order of the input.')
+
+    cache = budou.PersistentShelveCache(self.cache_path)
+    self.assertIsNotNone(cache.get(sources[-1], ':JapaneseSegmenter'),
+                         'The processes should share the cache file.')
+    cache.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
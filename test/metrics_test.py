@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import MagicMock
+from mock import patch
+import budou
+import socket
+import unittest
+
+TOKENS = [
+    {
+        u'text': {u'content': u'今日', u'beginOffset': 0},
+        u'dependencyEdge': {u'headTokenIndex': 1, u'label': u'NN'},
+        u'partOfSpeech': {u'tag': u'NOUN'},
+    },
+    {
+        u'text': {u'content': u'は', u'beginOffset': 2},
+        u'dependencyEdge': {u'headTokenIndex': 0, u'label': u'PRT'},
+        u'partOfSpeech': {u'tag': u'PRT'},
+    }]
+
+
+class TestMetrics(unittest.TestCase):
+
+  def setUp(self):
+    self.records = []
+    self.service = MagicMock()
+    self.service.documents().annotateText().execute.return_value = {
+        'tokens': TOKENS}
+    self.parser = budou.Budou(
+        self.service, metrics=budou.CallbackCollector(
+            lambda *args: self.records.append(args)))
+
+  def get_records(self, kind):
+    return [record[1:] for record in self.records if record[0] == kind]
+
+  def test_parse(self):
+    with patch('budou.budou.cache', budou.MemoryLRUCache()):
+      self.parser.parse(u'<b>今日</b>は', language='ja')
+      self.assertEqual(
+          [name for name, _, _ in self.get_records('timing')],
+          ['preprocess', 'dom', 'annotate', 'concatenate', 'migrate_html',
+           'render', 'parse'])
+      self.assertTrue(
+          all(seconds >= 0 for _, seconds, _ in self.get_records('timing')))
+      self.assertEqual(self.get_records('increment'), [
+          ('cache.miss', 1, {'backend': 'MemoryLRUCache'}),
+          ('api.requests', 1, None),
+          ('api.bytes', 9, None),
+          ('api.tokens', 2, None),
+      ])
+
+      del self.records[:]
+      self.parser.parse(u'<b>今日</b>は', language='ja')
+      self.assertEqual(self.get_records('increment'), [
+          ('cache.hit', 1, {'backend': 'MemoryLRUCache'})])
+      self.assertNotIn(
+          'annotate', [name for name, _, _ in self.get_records('timing')])
+
+  def test_parse_batch(self):
+    self.parser.register_segmenter('ja', budou.JapaneseSegmenter())
+    self.parser.parse_batch([u'今日は', u'晴れ'], language='ja', use_cache=False)
+    self.assertEqual(
+        [name for name, _, _ in self.get_records('timing')],
+        ['preprocess', 'dom', 'segment', 'concatenate', 'segment',
+         'concatenate', 'migrate_html', 'render'])
+    self.assertEqual(self.get_records('increment'), [])
+
+  def test_parse_batch_cache(self):
+    with patch('budou.budou.cache', budou.MemoryLRUCache()):
+      budou.budou.cache.set(u'今日', 'ja:api', self.parser._encode_chunks([]))
+      self.parser.parse_batch([u'今日', u'は', u'今日'], language='ja')
+      self.assertEqual(self.get_records('increment')[:2], [
+          ('cache.hit', 1, {'backend': 'MemoryLRUCache'}),
+          ('cache.miss', 1, {'backend': 'MemoryLRUCache'})])
+
+  def test_timer(self):
+    collector = budou.CallbackCollector(lambda *args: self.records.append(args))
+    with patch('budou.metrics.timeit.default_timer', side_effect=[10.0, 10.5]):
+      with budou.metrics.Timer(collector, 'render'):
+        pass
+    self.assertEqual(self.get_records('timing'), [('render', 0.5, None)],
+        'Timings should be measured by the monotonic timer.')
+
+  def test_disabled(self):
+    parser = budou.Budou(None)
+    self.assertIs(parser._measure('parse'), budou.metrics.NULL_TIMER)
+
+
+class TestStatsdCollector(unittest.TestCase):
+
+  def setUp(self):
+    self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.server.bind(('127.0.0.1', 0))
+    self.server.settimeout(5)
+    self.collector = budou.StatsdCollector(
+        '127.0.0.1', self.server.getsockname()[1])
+
+  def tearDown(self):
+    self.collector.close()
+    self.server.close()
+
+  def test_send(self):
+    self.collector.timing('render', 0.0015)
+    self.assertEqual(self.server.recv(1024), b'budou.render:1.500|ms')
+    self.collector.increment(
+        'cache.hit', tags={'backend': 'ShelveCache', 'a': 1})
+    self.assertEqual(
+        self.server.recv(1024), b'budou.cache.hit:1|c|#a:1,backend:ShelveCache')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import MagicMock
+import unittest
+import budou
+
+
+class TestJapaneseSegmenter(unittest.TestCase):
+
+  def setUp(self):
+    self.segmenter = budou.JapaneseSegmenter()
+    self.parser = budou.Budou(None, segmenter=self.segmenter)
+
+  def get_words(self, source):
+    chunks = self.parser._get_chunks(source, 'ja')
+    return [chunk.word for chunk in chunks]
+
+  def test_segment(self):
+    chunks = self.segmenter.segment(u'今日は晴れ。', 'ja')
+    expected = [
+        budou.Chunk(u'今日', u'NOUN', u'NN', False),
+        budou.Chunk(u'は', u'PRT', u'PRT', False),
+        budou.Chunk(u'晴', u'NOUN', u'NN', False),
+        budou.Chunk(u'れ', u'PRT', u'PRT', False),
+        budou.Chunk(u'。', u'PUNCT', u'P', False),
+    ]
+    self.assertEqual(chunks, expected)
+
+  def test_concatenate(self):
+    self.assertEqual(self.get_words(u'今日は晴れ。'), [u'今日は', u'晴れ。'])
+    self.assertEqual(
+        self.get_words(u'ご飯を3人で食べた！'), [u'ご飯を', u'3人で', u'食べた！'])
+    self.assertEqual(
+        self.get_words(u'私はお寿司を食べました。'),
+        [u'私は', u'お寿司を', u'食べました。'],
+        'A prefix at the end of hiragana should be attached to the noun.')
+    self.assertEqual(
+        self.get_words(u'これはご飯です。'), [u'これは', u'ご飯です。'])
+    self.assertEqual(
+        self.get_words(u'「カメラ」を買う'), [u'「カメラ」を', u'買う'])
+    self.assertEqual(
+        self.get_words(u'Budou は 便利'), [u'Budou', u' ', u'は', u' ', u'便利'])
+
+  def test_words_cover_source(self):
+    source = u'（株）テスト、ABC１２３です。\n　改行　…'
+    self.assertEqual(u''.join(self.get_words(source)), source)
+
+  def test_parse(self):
+    result = self.parser.parse(
+        u'今日は<b>晴れ</b>。', language='ja', use_cache=False)
+    self.assertEqual(
+        result['html_code'],
+        u'<span class="ww">今日は</span>'
+        u'<span class="ww"><b>晴れ</b>。</span>')
+
+  def test_parse_batch(self):
+    results = self.parser.parse_batch(
+        [u'今日は晴れ。', u'ご飯を食べた'], language='ja', use_cache=False)
+    self.assertEqual(
+        [[chunk.word for chunk in result['chunks']] for result in results],
+        [[u'今日は', u'晴れ。'], [u'ご飯を', u'食べた']])
+
+
+class TestSegmenterRegistry(unittest.TestCase):
+
+  def setUp(self):
+    self.parser = budou.Budou(None)
+    self.parser._get_chunks_with_api = MagicMock(
+        return_value=[budou.Chunk(u'API', None, None, True)])
+
+  def test_detect_language(self):
+    self.assertEqual(budou.detect_language(u'오늘은 맑음.'), 'ko')
+    self.assertEqual(budou.detect_language(u'今日は晴れ。'), 'ja')
+    self.assertEqual(budou.detect_language(u'東京'), '')
+    self.assertEqual(budou.detect_language(u'Hello'), '')
+    self.assertEqual(
+        budou.detect_language(u'日本語の文章に한が混ざる'), 'ja',
+        'A Hangul character in Japanese text should not make it Korean.')
+    self.assertEqual(
+        budou.detect_language(u'오늘은 「はい」라고 말했다'), 'ko',
+        'Kana in Korean text should not make it Japanese.')
+
+  def test_default_registry(self):
+    self.assertEqual(
+        [chunk.word for chunk in self.parser._get_chunks(u'a b', 'ko')],
+        [u'a', u' ', u'b'])
+    self.assertEqual(
+        [chunk.word for chunk in self.parser._get_chunks(u'a b', 'ja')],
+        [u'API'])
+    self.parser._get_chunks_with_api.assert_called_once_with(u'a b', 'ja')
+
+  def test_auto_detect(self):
+    chunks = self.parser._get_chunks(u'오늘은 맑음.', '')
+    self.assertEqual(
+        [chunk.word for chunk in chunks], [u'오늘은', u' ', u'맑음.'])
+    self.parser._get_chunks(u'今日は晴れ。', '')
+    self.parser._get_chunks_with_api.assert_called_once_with(u'今日は晴れ。', '')
+    self.parser._get_chunks(u'日本語の文章に한が混ざる', '')
+    self.parser._get_chunks_with_api.assert_called_with(
+        u'日本語の文章に한が混ざる', '')
+
+  def test_configure(self):
+    parser = budou.Budou(None, segmenters={
+        'ja': budou.JapaneseSegmenter(), 'ko': None})
+    parser._get_chunks_with_api = MagicMock(return_value=[])
+    self.assertEqual(
+        [chunk.word for chunk in parser._get_chunks(u'今日は晴れ。', 'ja-JP')],
+        [u'今日は', u'晴れ。'])
+    parser._get_chunks(u'오늘은 맑음.', 'ko')
+    parser._get_chunks_with_api.assert_called_once_with(u'오늘은 맑음.', 'ko')
+
+    parser.register_segmenter('ZH', budou.SpaceSegmenter())
+    self.assertEqual(
+        [chunk.word for chunk in parser._get_chunks(u'你好 世界', 'zh-TW')],
+        [u'你好', u' ', u'世界'])
+
+  def test_parse_batch(self):
+    self.parser._get_chunks_with_api_batch = MagicMock(
+        return_value=[[budou.Chunk(u'API', None, None, True)]])
+    results = self.parser.parse_batch(
+        [u'오늘은 맑음.', u'今日は晴れ。'], use_cache=False)
+    self.assertEqual(
+        [[chunk.word for chunk in result['chunks']] for result in results],
+        [[u'오늘은', u' ', u'맑음.'], [u'API']])
+    self.parser._get_chunks_with_api_batch.assert_called_once_with(
+        [u'今日は晴れ。'], '', budou.MAX_BATCH_BYTES)
+
+
+if __name__ == '__main__':
+  unittest.main()